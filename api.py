@@ -1,25 +1,40 @@
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, status, UploadFile, File, Form
 from fastapi.security import HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, Response
 from typing import List, Optional
-import aiofiles
+import base64
 import os
 from datetime import datetime, timedelta
 import logging
+from bson import ObjectId
 
 from config import settings
 from models import (
     User, EmailJob, EmailJobCreate, EmailJobUpdate, 
-    Token, GoogleAuthResponse, EmailSendResult
+    Token, GoogleAuthResponse, EmailSendResult, SendHistoryPage,
+    ProfileRequest, ProfileSession, ProfileTarget, SendRequest, SendStats, DailySendStats
 )
 from database import db
-from auth import google_oauth2, create_access_token, get_current_user
+from auth import google_oauth2, create_access_token, get_current_user, get_current_admin_user
+from google_http import google_http
+from attachments import attachment_storage
 from email_service import EmailService
 from scheduler import email_scheduler
+from dispatcher import send_dispatcher, SendLane
+from idempotency import idempotency_store, request_fingerprint
+from membership import membership
+from token_refresher import token_refresher
+from job_archiver import job_archiver
+from send_history import send_history
+from metrics import PrometheusMiddleware, render_metrics
+from health import health_monitor
+from profiler import profiler, ProfilingMiddleware
+from responses import ModelJSONResponse
+from logging_setup import setup_logging
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -37,6 +52,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record per-route request latency
+app.add_middleware(PrometheusMiddleware)
+
+# Profile requests to routes armed through /debug/profile
+app.add_middleware(ProfilingMiddleware)
+
 # Email service instance
 email_service = EmailService()
 
@@ -45,8 +66,15 @@ email_service = EmailService()
 async def startup_event():
     """Initialize database connection and start scheduler on startup."""
     try:
-        await db.connect_to_mongo()
+        await db.connect()
+        await google_http.start()
+        await send_history.start()
+        await membership.start()
+        await send_dispatcher.start()
         await email_scheduler.start()
+        await token_refresher.start()
+        await job_archiver.start()
+        await health_monitor.start()
         logger.info("Application started successfully")
     except Exception as e:
         logger.error(f"Failed to start application: {e}")
@@ -57,8 +85,16 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close database connection and stop scheduler on shutdown."""
+    await health_monitor.stop()
+    await job_archiver.stop()
+    await token_refresher.stop()
+    # Drains in-flight sends; partitions stay ours until they are done
     await email_scheduler.stop()
-    await db.close_mongo_connection()
+    await send_dispatcher.stop()
+    await membership.stop()
+    await send_history.stop()
+    await google_http.stop()
+    await db.close()
     logger.info("Application shutdown successfully")
 
 
@@ -98,6 +134,8 @@ async def google_auth_callback(code: str, state: Optional[str] = None):
         # Get user info from Google
         user_info = await google_oauth2.get_user_info(tokens["access_token"])
         
+        token_expiry = tokens.get("expiry") or datetime.utcnow() + timedelta(hours=1)
+        
         # Check if user exists
         existing_user = await db.get_user_by_google_id(user_info["id"])
         
@@ -107,7 +145,7 @@ async def google_auth_callback(code: str, state: Optional[str] = None):
                 existing_user.id,
                 tokens["access_token"],
                 tokens["refresh_token"],
-                datetime.utcnow() + timedelta(hours=1)  # Approximate expiry
+                token_expiry
             )
             user = existing_user
         else:
@@ -118,7 +156,7 @@ async def google_auth_callback(code: str, state: Optional[str] = None):
                 google_id=user_info["id"],
                 access_token=tokens["access_token"],
                 refresh_token=tokens["refresh_token"],
-                token_expiry=datetime.utcnow() + timedelta(hours=1)
+                token_expiry=token_expiry
             )
             user = await db.create_user(user)
         
@@ -151,7 +189,8 @@ async def test_email_connection(current_user: User = Depends(get_current_user)):
     try:
         is_valid = await email_service.test_email_connection(
             current_user.access_token,
-            current_user.refresh_token
+            current_user.refresh_token,
+            current_user.token_expiry
         )
         return {"valid": is_valid}
     except Exception as e:
@@ -159,32 +198,72 @@ async def test_email_connection(current_user: User = Depends(get_current_user)):
         return {"valid": False, "error": str(e)}
 
 
+def _jobs_etag(user: User, include_body: bool = True) -> str:
+    """Weak ETag for a user's job listing, from the user's jobs version."""
+    variant = "" if include_body else "-nobody"
+    return f'W/"jobs-{user.id}-{user.jobs_version}{variant}"'
+
+
+def _job_etag(job: EmailJob) -> str:
+    """Weak ETag for a single job, from its last update time."""
+    return f'W/"job-{job.id}-{job.updated_at.strftime("%Y%m%d%H%M%S%f")}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in (
+        candidate.removeprefix("W/") for candidate in candidates
+    )
+
+
+def _etag_headers(etag: str) -> dict:
+    # no-cache: clients may keep the response but must revalidate it every time
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
 # Email job endpoints
+async def _create_email_job(job_data: EmailJobCreate, current_user: User) -> Response:
+    # Create email job
+    email_job = EmailJob(
+        user_id=current_user.id,
+        recipient=job_data.recipient,
+        subject=job_data.subject,
+        body=job_data.body,
+        attachments=job_data.attachments,
+        every_n_days=job_data.every_n_days,
+        preferred_send_time=job_data.preferred_send_time or None,
+        priority=job_data.priority
+    )
+    
+    # Save to database
+    email_job = await db.create_email_job(email_job)
+    
+    # Schedule the job
+    await email_scheduler.schedule_job(email_job)
+    
+    return ModelJSONResponse(email_job)
+
+
 @app.post("/jobs", response_model=EmailJob)
 async def create_email_job(
     job_data: EmailJobCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Create a new email job."""
+    """Create a new email job; a retry with the same Idempotency-Key replays the first response."""
     try:
-        # Create email job
-        email_job = EmailJob(
-            user_id=current_user.id,
-            recipient=job_data.recipient,
-            subject=job_data.subject,
-            body=job_data.body,
-            attachments=job_data.attachments,
-            every_n_days=job_data.every_n_days
+        return await idempotency_store.run(
+            idempotency_key,
+            current_user.id,
+            request_fingerprint("POST", "/jobs", job_data.dict()),
+            lambda: _create_email_job(job_data, current_user)
         )
         
-        # Save to database
-        email_job = await db.create_email_job(email_job)
-        
-        # Schedule the job
-        await email_scheduler.schedule_job(email_job)
-        
-        return email_job
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating email job: {e}")
         raise HTTPException(
@@ -194,11 +273,24 @@ async def create_email_job(
 
 
 @app.get("/jobs", response_model=List[EmailJob])
-async def get_email_jobs(current_user: User = Depends(get_current_user)):
-    """Get all email jobs for the current user."""
+async def get_email_jobs(
+    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    include_body: bool = Query(True, description="Set to false to leave job bodies out of the listing")
+):
+    """Get all email jobs for the current user.
+
+    Answers 304 when If-None-Match carries the current ETag, without querying
+    the jobs: the ETag comes from the jobs version on the already loaded user.
+    """
     try:
-        jobs = await db.get_user_email_jobs(current_user.id)
-        return jobs
+        # Taken before the query, so a concurrent write can only make it stale
+        etag = _jobs_etag(current_user, include_body)
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_etag_headers(etag))
+        
+        jobs = await db.get_user_email_jobs(current_user.id, include_body)
+        return ModelJSONResponse(jobs, headers=_etag_headers(etag))
     except Exception as e:
         logger.error(f"Error getting email jobs: {e}")
         raise HTTPException(
@@ -210,9 +302,10 @@ async def get_email_jobs(current_user: User = Depends(get_current_user)):
 @app.get("/jobs/{job_id}", response_model=EmailJob)
 async def get_email_job(
     job_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
 ):
-    """Get a specific email job."""
+    """Get a specific email job, answering 304 when If-None-Match is current."""
     try:
         job = await db.get_email_job(job_id, current_user.id)
         if not job:
@@ -220,7 +313,10 @@ async def get_email_job(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Email job not found"
             )
-        return job
+        etag = _job_etag(job)
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=_etag_headers(etag))
+        return ModelJSONResponse(job, headers=_etag_headers(etag))
     except HTTPException:
         raise
     except Exception as e:
@@ -259,21 +355,34 @@ async def update_email_job(
             update_data["attachments"] = job_update.attachments
         if job_update.status is not None:
             update_data["status"] = job_update.status
+        if job_update.preferred_send_time is not None:
+            update_data["preferred_send_time"] = job_update.preferred_send_time or None
+        if job_update.priority is not None:
+            update_data["priority"] = job_update.priority
         
         # Update job
         updated_job = await db.update_email_job(job_id, current_user.id, update_data)
-        
-        # Update schedule if every_n_days changed
-        if job_update.every_n_days is not None:
-            await email_scheduler.update_job_schedule(job_id, current_user.id, job_update.every_n_days)
+        if not updated_job:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Email job not found"
+            )
+
+        # Update schedule if every_n_days or the preferred send time changed
+        if job_update.every_n_days is not None or job_update.preferred_send_time is not None:
+            await email_scheduler.update_job_schedule(
+                job_id,
+                current_user.id,
+                job_update.every_n_days or current_job.every_n_days
+            )
         
         # Handle pause/resume
         if job_update.status == "paused":
             await email_scheduler.pause_job(job_id, current_user.id)
-        elif job_update.status == "active" and current_job.status == "paused":
+        elif job_update.status == "active" and current_job.status in ("paused", "failed"):
             await email_scheduler.resume_job(job_id, current_user.id)
         
-        return updated_job
+        return ModelJSONResponse(updated_job)
         
     except HTTPException:
         raise
@@ -343,49 +452,179 @@ async def resume_email_job(
         )
 
 
-@app.post("/jobs/{job_id}/send-now")
+async def _send_email_now(job_id: str, current_user: User) -> Response:
+    job = await db.get_email_job(job_id, current_user.id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Email job not found"
+        )
+    if not send_dispatcher.is_running:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Sending is not available"
+        )
+    
+    send_request = await db.create_send_request(SendRequest(job_id=job.id, user_id=current_user.id))
+    try:
+        send_dispatcher.submit(
+            SendLane.INTERACTIVE,
+            lambda: email_scheduler.send_requested(send_request, job),
+            on_abandon=lambda: email_scheduler.fail_send_request(send_request, "Cancelled by shutdown")
+        )
+    except RuntimeError:
+        # Shutdown began while the request was being stored
+        await email_scheduler.fail_send_request(send_request, "Cancelled by shutdown")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Sending is not available"
+        )
+    
+    return ModelJSONResponse(
+        send_request,
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/sends/{send_request.id}"}
+    )
+
+
+@app.post("/jobs/{job_id}/send-now", response_model=SendRequest, status_code=status.HTTP_202_ACCEPTED)
 async def send_email_now(
     job_id: str,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Queue an email to be sent immediately; poll GET /sends/{send_id} for the outcome.
+
+    A retry with the same Idempotency-Key replays the first response instead
+    of sending again.
+    """
+    try:
+        return await idempotency_store.run(
+            idempotency_key,
+            current_user.id,
+            request_fingerprint("POST", f"/jobs/{job_id}/send-now"),
+            lambda: _send_email_now(job_id, current_user)
+        )
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error queueing email send: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to queue email"
+        )
+
+
+@app.get("/sends/{send_id}", response_model=SendRequest)
+async def get_send_request(
+    send_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    """Send an email immediately."""
+    """Get the status of a send-now request."""
     try:
-        job = await db.get_email_job(job_id, current_user.id)
-        if not job:
+        send_request = await db.get_send_request(send_id, current_user.id)
+        if not send_request:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="Email job not found"
+                detail="Send request not found"
             )
+        return send_request
         
-        result = await email_service.send_email(
-            job,
-            current_user.access_token,
-            current_user.refresh_token
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting send request: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get send request"
+        )
+
+
+def _encode_history_cursor(sent_at: datetime, entry_id: str) -> str:
+    """Encode the keyset position of a send history entry as an opaque cursor."""
+    raw = f"{sent_at.isoformat()}|{entry_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_history_cursor(cursor: str) -> tuple:
+    """Decode a cursor produced by _encode_history_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        sent_at, entry_id = raw.split("|", 1)
+        if not ObjectId.is_valid(entry_id):
+            raise ValueError(f"Invalid entry id {entry_id!r}")
+        return datetime.fromisoformat(sent_at), entry_id
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+@app.get("/jobs/{job_id}/history", response_model=SendHistoryPage)
+async def get_email_job_history(
+    job_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the send history of an email job, newest first.
+
+    Pass the returned ``next_cursor`` as ``cursor`` to fetch the next page.
+    """
+    try:
+        before = _decode_history_cursor(cursor) if cursor else None
+        entries = await db.get_job_send_history(job_id, current_user.id, limit, before)
+        next_cursor = None
+        if len(entries) == limit:
+            last = entries[-1]
+            next_cursor = _encode_history_cursor(last.sent_at, last.id)
+        return SendHistoryPage(items=entries, next_cursor=next_cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting email job history: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get email job history"
+        )
+
+
+@app.get("/stats", response_model=SendStats)
+async def get_send_stats(
+    days: int = Query(30, ge=1, le=366),
+    current_user: User = Depends(get_current_user)
+):
+    """Get sent and failed send attempts per UTC day for the last ``days`` days.
+
+    Read from per-day rollups, so the cost depends on ``days`` only, not on
+    how many jobs or sends the user has.
+    """
+    try:
+        end_day = datetime.utcnow().date()
+        start_day = end_day - timedelta(days=days - 1)
+        rollups = {
+            rollup.date: rollup
+            for rollup in await db.get_send_rollups(current_user.id, start_day, end_day)
+        }
+        daily = [
+            rollups.get(start_day + timedelta(days=offset), DailySendStats(date=start_day + timedelta(days=offset)))
+            for offset in range(days)
+        ]
+        return SendStats(
+            days=daily,
+            sent=sum(day.sent for day in daily),
+            failed=sum(day.failed for day in daily),
+            pending=await db.count_pending_jobs(current_user.id)
         )
-        
-        if result.success:
-            # Update job with sent time
-            sent_time = result.sent_at
-            next_send = sent_time + timedelta(days=job.every_n_days)
-            await db.update_job_sent_time(job.id, sent_time, next_send)
-            
-            return {
-                "message": "Email sent successfully",
-                "sent_at": result.sent_at.isoformat()
-            }
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to send email: {result.error_message}"
-            )
-            
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error sending email now: {e}")
+        logger.error(f"Error getting send stats: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to send email"
+            detail="Failed to get send stats"
         )
 
 
@@ -404,20 +643,28 @@ async def upload_file(
                 detail="File too large"
             )
         
-        # Create user-specific upload directory
-        user_upload_dir = os.path.join(settings.upload_dir, current_user.id)
-        os.makedirs(user_upload_dir, exist_ok=True)
+        filename = os.path.basename(file.filename or "") or "attachment"
+        size = 0
+        
+        async def chunks():
+            nonlocal size
+            while chunk := await file.read(settings.attachment_chunk_bytes):
+                size += len(chunk)
+                # file.size is not always known up front
+                if size > settings.max_file_size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="File too large"
+                    )
+                yield chunk
         
         # Save file
-        file_path = os.path.join(user_upload_dir, file.filename)
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        file_path = await attachment_storage.save(current_user.id, filename, chunks())
         
         return {
-            "filename": file.filename,
+            "filename": filename,
             "file_path": file_path,
-            "size": len(content)
+            "size": size
         }
         
     except HTTPException:
@@ -432,22 +679,79 @@ async def upload_file(
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    db_status = "unknown"
+    """Health check endpoint, served from the background-refreshed status snapshot."""
+    return Response(content=health_monitor.snapshot_body, media_type="application/json")
+
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and its event loop is responsive."""
+    return Response(content=b'{"status":"alive"}', media_type="application/json")
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: the last status snapshot is recent and the database was reachable."""
+    return Response(
+        content=health_monitor.snapshot_body,
+        media_type="application/json",
+        status_code=status.HTTP_200_OK if health_monitor.is_ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+# Debug endpoints
+@app.post("/debug/profile", response_model=ProfileSession)
+async def start_profiling(
+    profile_request: ProfileRequest,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Profile the next N scheduler ticks or requests to a route."""
+    if profile_request.target == ProfileTarget.ROUTE:
+        route_paths = {getattr(route, "path", None) for route in app.routes}
+        if profile_request.route not in route_paths:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Unknown route; pass a route template such as /jobs/{job_id}"
+            )
     try:
-        if db.client:
-            await db.client.admin.command('ping')
-            db_status = "connected"
-        else:
-            db_status = "not_connected"
-    except Exception as e:
-        db_status = f"error: {str(e)}"
-    
-    return {
-        "status": "healthy" if db_status == "connected" else "degraded",
-        "timestamp": datetime.utcnow().isoformat(),
-        "database": db_status,
-        "scheduler_running": email_scheduler.is_running,
-        "mongodb_url": settings.mongodb_url if settings.debug else "hidden",
-        "mongodb_db": settings.mongodb_db
-    } 
\ No newline at end of file
+        return profiler.arm(profile_request.target, profile_request.count, profile_request.route)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@app.get("/debug/profile/{session_id}", response_model=ProfileSession)
+async def get_profiling_session(
+    session_id: str,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Get a profiling session, including the top functions once it is complete."""
+    session = profiler.get_session(session_id)
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiling session not found"
+        )
+    return session
+
+
+@app.get("/debug/profile/{session_id}/pstats")
+async def download_profiling_stats(
+    session_id: str,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Download the .pstats file of a completed profiling session."""
+    from fastapi.responses import FileResponse
+    session = profiler.get_session(session_id)
+    if not session or not session.pstats_path:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profiling stats not available"
+        )
+    return FileResponse(session.pstats_path, filename=f"{session_id}.pstats")
@@ -0,0 +1,205 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict
+import aiofiles
+import aiofiles.os
+import asyncio
+import logging
+import os
+import time
+import uuid
+from config import settings
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Attachment references with this prefix live in GridFS; anything else is a local path
+GRIDFS_PREFIX = "gridfs://"
+
+# Cached files resolved this recently are never trimmed, as a send may be reading them
+CACHE_IN_USE_SECONDS = 60
+
+
+class AttachmentNotFoundError(ValueError):
+    """An attachment reference does not resolve to a file its job's owner may use."""
+
+
+class AttachmentStorage(ABC):
+    """Where uploaded attachments are kept.
+
+    ``save`` returns the reference stored in EmailJob.attachments;
+    ``local_path`` turns a reference back into a readable local file.
+    """
+
+    @abstractmethod
+    async def save(self, user_id: str, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        """Store an upload streamed in chunks and return its reference."""
+
+    @abstractmethod
+    async def local_path(self, reference: str, user_id: str) -> str:
+        """Local path of a user's attachment; raises AttachmentNotFoundError."""
+
+
+class LocalAttachmentStorage(AttachmentStorage):
+    """Attachments on local disk under UPLOAD_DIR/<user_id>; only usable from one node."""
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(settings.upload_dir, user_id)
+
+    async def save(self, user_id: str, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        """Stream an upload to UPLOAD_DIR/<user_id>/<filename>."""
+        await aiofiles.os.makedirs(self._user_dir(user_id), exist_ok=True)
+        file_path = os.path.join(self._user_dir(user_id), filename)
+        try:
+            async with aiofiles.open(file_path, 'wb') as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+        except BaseException:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+        return file_path
+
+    async def local_path(self, reference: str, user_id: str) -> str:
+        """The reference itself, once checked to be one of the user's uploads."""
+        user_dir = os.path.realpath(self._user_dir(user_id))
+        path = os.path.realpath(reference)
+        if os.path.dirname(path) != user_dir or not await aiofiles.os.path.isfile(path):
+            raise AttachmentNotFoundError(f"Attachment not found: {reference}")
+        return reference
+
+
+class GridFSAttachmentStorage(AttachmentStorage):
+    """Attachments in MongoDB GridFS, shared by every node.
+
+    Senders read them through a local read-through cache in
+    ATTACHMENT_CACHE_DIR, bounded to ATTACHMENT_CACHE_MAX_BYTES. Stored files
+    never change, so cached copies never go stale.
+    """
+
+    def __init__(self):
+        # Downloads in progress by cache directory, shared by concurrent sends
+        self._downloads: Dict[str, asyncio.Future] = {}
+
+    def _bucket(self):
+        from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+        return AsyncIOMotorGridFSBucket(
+            db.db,
+            bucket_name="attachments",
+            chunk_size_bytes=settings.attachment_chunk_bytes
+        )
+
+    async def save(self, user_id: str, filename: str, chunks: AsyncIterator[bytes]) -> str:
+        """Stream an upload into GridFS, chunk by chunk."""
+        grid_in = self._bucket().open_upload_stream(filename, metadata={"user_id": user_id})
+        try:
+            async for chunk in chunks:
+                await grid_in.write(chunk)
+        except BaseException:
+            await grid_in.abort()
+            raise
+        await grid_in.close()
+        return f"{GRIDFS_PREFIX}{grid_in._id}"
+
+    async def local_path(self, reference: str, user_id: str) -> str:
+        """Path of the cached copy, downloading it into the cache on a miss."""
+        from bson import ObjectId
+        from bson.errors import InvalidId
+        if not reference.startswith(GRIDFS_PREFIX):
+            raise AttachmentNotFoundError(f"Attachment not found: {reference}")
+        file_id = reference[len(GRIDFS_PREFIX):]
+        try:
+            object_id = ObjectId(file_id)
+        except InvalidId:
+            raise AttachmentNotFoundError(f"Attachment not found: {reference}")
+
+        # Cached under <user_id>/<file_id>/<filename>, so ownership is part of the path
+        cache_dir = os.path.join(settings.attachment_cache_dir, user_id, file_id)
+        download = self._downloads.get(cache_dir)
+        if download is None:
+            cached = await asyncio.to_thread(self._cached_file, cache_dir)
+            if cached:
+                return cached
+            download = self._downloads.get(cache_dir)
+            if download is None:
+                download = asyncio.ensure_future(self._download(object_id, reference, user_id, cache_dir))
+                self._downloads[cache_dir] = download
+                download.add_done_callback(lambda _: self._downloads.pop(cache_dir, None))
+        return await asyncio.shield(download)
+
+    def _cached_file(self, cache_dir: str):
+        if not os.path.isdir(cache_dir):
+            return None
+        for name in os.listdir(cache_dir):
+            if not name.startswith("."):
+                path = os.path.join(cache_dir, name)
+                # mtime is the recency the cache is trimmed by
+                os.utime(path)
+                return path
+        return None
+
+    async def _download(self, object_id, reference: str, user_id: str, cache_dir: str) -> str:
+        from gridfs.errors import NoFile
+        try:
+            grid_out = await self._bucket().open_download_stream(object_id)
+        except NoFile:
+            raise AttachmentNotFoundError(f"Attachment not found: {reference}")
+        if (grid_out.metadata or {}).get("user_id") != user_id:
+            raise AttachmentNotFoundError(f"Attachment not found: {reference}")
+
+        await aiofiles.os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, os.path.basename(grid_out.filename) or "attachment")
+        # Written under a hidden name and renamed, so a partial file is never served
+        partial = os.path.join(cache_dir, f".{uuid.uuid4().hex}.part")
+        try:
+            async with aiofiles.open(partial, 'wb') as f:
+                while True:
+                    chunk = await grid_out.readchunk()
+                    if not chunk:
+                        break
+                    await f.write(chunk)
+            await aiofiles.os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        await asyncio.to_thread(self._trim_cache)
+        return path
+
+    def _trim_cache(self):
+        """Delete the least recently used cached files beyond ATTACHMENT_CACHE_MAX_BYTES.
+
+        Files resolved in the last CACHE_IN_USE_SECONDS are kept, even over the limit.
+        """
+        in_use_since = time.time() - CACHE_IN_USE_SECONDS
+        files = []
+        for root, _, names in os.walk(settings.attachment_cache_dir):
+            for name in names:
+                if not name.startswith("."):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if total <= settings.attachment_cache_max_bytes or mtime >= in_use_since:
+                break
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+            total -= size
+
+
+def create_attachment_storage() -> AttachmentStorage:
+    """Create the attachment storage configured by ATTACHMENT_STORAGE."""
+    if settings.attachment_storage == "gridfs":
+        if settings.database_backend != "mongodb":
+            raise ValueError("ATTACHMENT_STORAGE=gridfs requires DATABASE_BACKEND=mongodb")
+        return GridFSAttachmentStorage()
+    if settings.attachment_storage == "local":
+        return LocalAttachmentStorage()
+    raise ValueError(f"Unknown ATTACHMENT_STORAGE: {settings.attachment_storage}")
+
+
+# Create attachment storage instance
+attachment_storage = create_attachment_storage()
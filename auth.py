@@ -3,13 +3,10 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import httpx
 import logging
 from config import settings
+from google_http import google_http
 from models import TokenData, User
 from database import db
 
@@ -64,7 +61,29 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     return user
 
 
+async def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Get current authenticated user, requiring them to be listed in ADMIN_EMAILS."""
+    admin_emails = {email.strip().lower() for email in settings.admin_emails.split(",") if email.strip()}
+    if current_user.email.lower() not in admin_emails:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
+
+
+class TokenGrantError(Exception):
+    """The token endpoint rejected the grant (e.g. invalid_grant); retrying will not help."""
+
+
 class GoogleOAuth2:
+    """Google OAuth2 login and token refresh.
+
+    The client config and authorization Flow are built once per process, and
+    token endpoint and userinfo calls go over the shared Google HTTP client,
+    so a burst of logins or refreshes never blocks the event loop.
+    """
+
     def __init__(self):
         self.client_id = settings.google_client_id
         self.client_secret = settings.google_client_secret
@@ -75,63 +94,72 @@ class GoogleOAuth2:
     'https://www.googleapis.com/auth/userinfo.profile',
     'https://www.googleapis.com/auth/gmail.send'
 ]
-
-
-
+        self.client_config = {
+            "web": {
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "auth_uri": settings.google_auth_uri,
+                "token_uri": settings.google_token_uri,
+                "redirect_uris": [self.redirect_uri]
+            }
+        }
+        self._flow: Optional[Flow] = None
+
+    @property
+    def flow(self) -> Flow:
+        """The process-wide authorization Flow."""
+        if self._flow is None:
+            # No PKCE: the verifier would be per login, but the Flow is shared and
+            # the code is redeemed with the client secret
+            self._flow = Flow.from_client_config(
+                self.client_config,
+                scopes=self.scope,
+                autogenerate_code_verifier=False
+            )
+            self._flow.redirect_uri = self.redirect_uri
+        return self._flow
 
     def get_authorization_url(self) -> str:
         """Get Google OAuth2 authorization URL."""
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [self.redirect_uri]
-                }
-            },
-            scopes=self.scope
-        )
-        flow.redirect_uri = self.redirect_uri
-        authorization_url, _ = flow.authorization_url(
+        authorization_url, _ = self.flow.authorization_url(
             access_type='offline',
             include_granted_scopes='true',
             prompt='consent'
         )
         return authorization_url
 
+    async def _request_tokens(self, grant: dict) -> dict:
+        """POST a grant to the token endpoint and return the tokens in the shape callers expect."""
+        requested_at = datetime.utcnow()
+        response = await google_http.client.post(
+            settings.google_token_uri,
+            data={**grant, "client_id": self.client_id, "client_secret": self.client_secret}
+        )
+        # Google answers a revoked or invalid grant or client with 400/401; anything
+        # else (5xx, 429) is transient and raised as httpx.HTTPStatusError
+        if response.status_code in (400, 401):
+            raise TokenGrantError(f"Token endpoint returned {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        payload = response.json()
+        return {
+            "access_token": payload["access_token"],
+            "refresh_token": payload.get("refresh_token"),
+            # Naive UTC, as google-auth credentials use
+            "expiry": requested_at + timedelta(seconds=payload.get("expires_in", 3600)),
+            "token_uri": settings.google_token_uri,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scopes": payload["scope"].split() if payload.get("scope") else self.scope
+        }
+
     async def exchange_code_for_tokens(self, code: str) -> dict:
         """Exchange authorization code for access and refresh tokens."""
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [self.redirect_uri]
-                }
-            },
-            scopes=self.scope
-        )
-        flow.redirect_uri = self.redirect_uri
-        
         try:
-            # Use a custom session that ignores scope changes
-            import warnings
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                flow.fetch_token(code=code)
-            
-            return {
-                "access_token": flow.credentials.token,
-                "refresh_token": flow.credentials.refresh_token,
-                "token_uri": flow.credentials.token_uri,
-                "client_id": flow.credentials.client_id,
-                "client_secret": flow.credentials.client_secret,
-                "scopes": flow.credentials.scopes
-            }
+            return await self._request_tokens({
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": self.redirect_uri
+            })
         except Exception as e:
             logger.error(f"Error exchanging code for tokens: {e}")
             raise HTTPException(
@@ -141,58 +169,40 @@ class GoogleOAuth2:
 
     async def get_user_info(self, access_token: str) -> dict:
         """Get user information from Google."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                headers={"Authorization": f"Bearer {access_token}"}
+        response = await google_http.client.get(
+            settings.google_userinfo_url,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Failed to get user info from Google"
             )
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to get user info from Google"
-                )
-            return response.json()
+        return response.json()
 
     async def refresh_access_token(self, refresh_token: str) -> dict:
-        """Refresh access token using refresh token."""
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [self.redirect_uri]
-                }
-            },
-            scopes=self.scope
-        )
-        
-        credentials = Credentials(
-            token=None,
-            refresh_token=refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=self.client_id,
-            client_secret=self.client_secret,
-            scopes=self.scope
-        )
-        
+        """Refresh access token using refresh token.
+
+        Raises HTTPException(400) when Google rejects the refresh token;
+        network errors and 5xx responses are raised unchanged.
+        """
         try:
-            credentials.refresh(Request())
-            return {
-                "access_token": credentials.token,
-                "refresh_token": credentials.refresh_token,
-                "token_uri": credentials.token_uri,
-                "client_id": credentials.client_id,
-                "client_secret": credentials.client_secret,
-                "scopes": credentials.scopes
-            }
-        except Exception as e:
+            tokens = await self._request_tokens({
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token
+            })
+            # Google only returns a refresh token when it rotates it
+            tokens["refresh_token"] = tokens["refresh_token"] or refresh_token
+            return tokens
+        except TokenGrantError as e:
             logger.error(f"Error refreshing access token: {e}")
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Failed to refresh access token"
             )
+        except Exception as e:
+            logger.error(f"Error refreshing access token: {e}")
+            raise
 
 
 # Create OAuth2 instance
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-job cost of turning a stored job document into an EmailJob.
+
+Compares full pydantic validation (EmailJob(**doc), the old read path) with the
+trusted EmailJob.from_trusted path used by the database read methods.
+
+Usage:
+    python benchmarks/bench_job_decode.py --documents 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from models import EmailJob
+
+
+def make_documents(count):
+    """Documents shaped like what get_due_email_jobs reads from MongoDB."""
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": str(ObjectId()),
+            "recipient": f"recipient{i}@example.com",
+            "subject": f"Subject {i}",
+            "body": "Hello, this is a recurring reminder.",
+            "attachments": [],
+            "every_n_days": 7,
+            "last_sent": now - timedelta(days=7),
+            "next_send": now,
+            "status": "active",
+            "attempts": 0,
+            "last_error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        for i in range(count)
+    ]
+
+
+def decode_validated(documents):
+    jobs = []
+    for job_dict in documents:
+        job_dict["id"] = str(job_dict["_id"])
+        jobs.append(EmailJob(**job_dict))
+    return jobs
+
+
+def decode_trusted(documents):
+    jobs = []
+    for job_dict in documents:
+        job_dict["id"] = str(job_dict["_id"])
+        jobs.append(EmailJob.from_trusted(job_dict))
+    return jobs
+
+
+def measure(decode, count, repeat):
+    best = None
+    for _ in range(repeat):
+        documents = make_documents(count)
+        started = time.perf_counter()
+        decode(documents)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="Best of N runs")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"documents": args.documents}
+    for name, decode in (("validated", decode_validated), ("trusted", decode_trusted)):
+        elapsed = measure(decode, args.documents, args.repeat)
+        results[name] = {
+            "total_s": round(elapsed, 4),
+            "per_job_us": round(elapsed / args.documents * 1e6, 3)
+        }
+    results["speedup"] = round(results["validated"]["total_s"] / results["trusted"]["total_s"], 2)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
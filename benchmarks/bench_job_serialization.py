@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: cost of rendering a large GET /jobs listing.
+
+Compares FastAPI's default response_model path (re-validate every EmailJob,
+jsonable_encoder, stdlib json) with the ModelJSONResponse the job routes
+return, and checks both produce the same JSON.
+
+Usage:
+    python benchmarks/bench_job_serialization.py --jobs 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from models import EmailJob
+from responses import ModelJSONResponse
+
+
+def make_jobs(count):
+    """Jobs shaped like what get_user_email_jobs returns."""
+    now = datetime.utcnow()
+    user_id = str(ObjectId())
+    return [
+        EmailJob.from_trusted({
+            "id": str(ObjectId()),
+            "user_id": user_id,
+            "recipient": f"recipient{i}@example.com",
+            "subject": f"Subject {i}",
+            "body": "Hello, this is a recurring reminder.",
+            "attachments": [],
+            "every_n_days": 7,
+            "last_sent": now - timedelta(days=7),
+            "next_send": now,
+            "status": "active",
+            "attempts": 0,
+            "last_error": None,
+            "created_at": now,
+            "updated_at": now
+        })
+        for i in range(count)
+    ]
+
+
+_field = create_response_field(name="Response_get_email_jobs", type_=List[EmailJob])
+
+
+def render_default(jobs):
+    content = asyncio.run(serialize_response(field=_field, response_content=jobs, is_coroutine=True))
+    return JSONResponse(content).body
+
+
+def render_fast(jobs):
+    return ModelJSONResponse(jobs).body
+
+
+def measure(render, jobs, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render(jobs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5, help="Best of N runs")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs)
+    if json.loads(render_default(jobs)) != json.loads(render_fast(jobs)):
+        sys.exit("Rendered listings differ between the default and fast paths")
+
+    results = {"jobs": args.jobs}
+    for name, render in (("default", render_default), ("fast", render_fast)):
+        elapsed = measure(render, jobs, args.repeat)
+        results[name] = {
+            "total_ms": round(elapsed * 1000, 2),
+            "jobs_per_sec": round(args.jobs / elapsed)
+        }
+    results["speedup"] = round(results["default"]["total_ms"] / results["fast"]["total_ms"], 2)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Fake Google OAuth2 / userinfo / Gmail HTTP server for benchmarks.
+
+Serves the three endpoints the send path talks to, with configurable latency
+and error injection, and counts the requests it receives.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+import json
+import random
+import threading
+import time
+import uuid
+
+
+class FakeGoogleServer:
+    """Threaded HTTP server impersonating the Google endpoints used by the app."""
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, Nagle's
+            # algorithm and the client's delayed ACK add ~40ms to every response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _respond(self, status_code: int, payload: dict):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                self._read_body()
+                path = self.path.split("?", 1)[0]
+                with server._lock:
+                    server.requests[path] += 1
+
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+
+                if path == "/token":
+                    self._respond(200, {
+                        "access_token": f"fake-{uuid.uuid4().hex}",
+                        "expires_in": 3600,
+                        "token_type": "Bearer"
+                    })
+                elif path == "/userinfo":
+                    token = self.headers.get("Authorization", "").replace("Bearer ", "")
+                    self._respond(200, {
+                        "id": token,
+                        "email": "bench.sender@example.com",
+                        "name": "Bench Sender"
+                    })
+                elif path.endswith("/messages/send"):
+                    if server._should_fail():
+                        self._respond(server.error_status, {
+                            "error": {"code": server.error_status, "message": "Injected failure"}
+                        })
+                    else:
+                        self._respond(200, {"id": uuid.uuid4().hex, "labelIds": ["SENT"]})
+                elif path.endswith("/profile"):
+                    self._respond(200, {"emailAddress": "bench.sender@example.com"})
+                else:
+                    self._respond(404, {"error": {"code": 404, "message": "Not found"}})
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the email scheduler.
+
+Seeds N users and M due jobs, runs EmailScheduler.check_and_send_emails against
+a local fake Google server (see fake_google.py) and drives the FastAPI app
+through httpx's ASGI transport. Reports scheduler throughput, API latency
+percentiles, peak RSS and database operation counts, and writes them as JSON
+so runs from different versions can be compared.
+
+Usage:
+    python benchmarks/run_benchmark.py --users 50 --jobs 2000 --output before.json
+    python benchmarks/run_benchmark.py --gmail-latency-ms 50 --error-rate 0.05
+    python benchmarks/run_benchmark.py --compare before.json after.json
+
+By default MongoDB is replaced by an in-process mongomock stand-in
+(pip install -r benchmarks/requirements.txt). Use --backend mongodb to run
+against a real mongod at --mongodb-url (the benchmark database is dropped on
+every run), or --backend sqlite for the embedded SQLite backend.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_google import FakeGoogleServer
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def db_operation_counts():
+    """Number of calls per Database method recorded so far."""
+    from metrics import DB_OPERATION_DURATION
+    counts = {}
+    for metric in DB_OPERATION_DURATION.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count"):
+                counts[sample.labels["operation"]] = int(sample.value)
+    return counts
+
+
+def counts_delta(before, after):
+    return {op: after[op] - before.get(op, 0) for op in sorted(after) if after[op] - before.get(op, 0)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+async def connect(args):
+    """Connect the application's Database to the benchmark database, starting empty."""
+    from config import settings
+    from database import db
+
+    if args.backend == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+        db.client = AsyncMongoMockClient()
+        db.db = db.client[settings.mongodb_db]
+        return db
+
+    await db.connect()
+    if not db.is_connected:
+        raise RuntimeError(f"Could not connect to the {args.backend} benchmark database")
+    if args.backend == "mongodb":
+        await db.client.drop_database(settings.mongodb_db)
+        db.db = db.client[settings.mongodb_db]
+    return db
+
+
+async def seed(db, args):
+    """Insert N users and M due jobs spread round-robin across them."""
+    from models import User, EmailJob
+
+    now = datetime.utcnow()
+    users = []
+    for i in range(args.users):
+        users.append(await db.create_user(User(
+            email=f"user{i}@example.com",
+            name=f"Bench User {i}",
+            google_id=f"bench-user-{i}",
+            access_token=f"access-{i}",
+            refresh_token=f"refresh-{i}",
+            token_expiry=now + timedelta(days=1)
+        )))
+
+    rng = random.Random(args.seed)
+    body = ("Lorem ipsum dolor sit amet. " * (args.body_bytes // 28 + 1))[:args.body_bytes]
+    jobs = [
+        EmailJob(
+            user_id=users[i % len(users)].id,
+            recipient=f"recipient{i}@example.com",
+            subject=f"Benchmark email {i}",
+            body=body,
+            every_n_days=rng.randint(1, 30),
+            next_send=now - timedelta(minutes=rng.randint(1, 600))
+        )
+        for i in range(args.jobs)
+    ]
+    job_ids = []
+    for start in range(0, len(jobs), 1000):
+        created = await db.create_email_jobs(jobs[start:start + 1000])
+        job_ids.extend(job.id for job in created)
+    return users, job_ids
+
+
+async def run_scheduler_phase(args):
+    from prometheus_client import REGISTRY
+    from scheduler import email_scheduler
+    from send_history import send_history
+
+    def sends(outcome):
+        return REGISTRY.get_sample_value("email_sends_total", {"outcome": outcome}) or 0
+
+    ops_before = db_operation_counts()
+    succeeded_before, failed_before = sends("success"), sends("failure")
+
+    started = time.perf_counter()
+    await email_scheduler.check_and_send_emails()
+    elapsed = time.perf_counter() - started
+    await send_history.flush()
+
+    succeeded = sends("success") - succeeded_before
+    failed = sends("failure") - failed_before
+    return {
+        "duration_s": round(elapsed, 4),
+        "jobs_attempted": int(succeeded + failed),
+        "jobs_succeeded": int(succeeded),
+        "jobs_failed": int(failed),
+        "jobs_per_sec": round((succeeded + failed) / elapsed, 2) if elapsed else None,
+        "db_ops": counts_delta(ops_before, db_operation_counts())
+    }
+
+
+async def run_api_phase(args, users, job_ids):
+    import httpx
+    from api import app
+    from auth import create_access_token
+
+    tokens = [create_access_token(data={"sub": user.google_id}) for user in users]
+    rng = random.Random(args.seed)
+    latencies = {"/jobs": [], "/jobs/{job_id}": []}
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.api_concurrency)
+    ops_before = db_operation_counts()
+
+    async def one_request(client, i):
+        user_index = rng.randrange(len(users))
+        headers = {"Authorization": f"Bearer {tokens[user_index]}"}
+        if i % 2 == 0:
+            route, url = "/jobs", "/jobs"
+        else:
+            # Jobs were seeded round-robin, so this job belongs to the user
+            job_index = user_index + len(users) * rng.randrange(max(1, len(job_ids) // len(users)))
+            route, url = "/jobs/{job_id}", f"/jobs/{job_ids[min(job_index, len(job_ids) - 1)]}"
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            latencies[route].append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(client, i) for i in range(args.api_requests)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "requests": args.api_requests,
+        "duration_s": round(elapsed, 4),
+        "requests_per_sec": round(args.api_requests / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(all_latencies, 50), 3),
+        "p99_ms": round(percentile(all_latencies, 99), 3),
+        "routes": {
+            route: {
+                "requests": len(values),
+                "p50_ms": round(percentile(values, 50), 3) if values else None,
+                "p99_ms": round(percentile(values, 99), 3) if values else None
+            }
+            for route, values in latencies.items()
+        },
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "db_ops": counts_delta(ops_before, db_operation_counts())
+    }
+
+
+async def run(args):
+    server = FakeGoogleServer(
+        latency_ms=args.gmail_latency_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed
+    )
+    server.start()
+
+    # Point the application at the fake server before its settings are loaded
+    os.environ["GOOGLE_TOKEN_URI"] = f"{server.url}/token"
+    os.environ["GOOGLE_USERINFO_URL"] = f"{server.url}/userinfo"
+    os.environ["GMAIL_API_ENDPOINT"] = f"{server.url}/"
+    os.environ["MONGODB_DB"] = args.db_name
+    os.environ["DATABASE_BACKEND"] = "sqlite" if args.backend == "sqlite" else "mongodb"
+    os.environ["SCHEDULER_MAX_JOBS_PER_TICK"] = str(args.max_jobs_per_tick)
+    if args.mongodb_url:
+        os.environ["MONGODB_URL"] = args.mongodb_url
+    if args.backend == "sqlite":
+        sqlite_dir = tempfile.mkdtemp(prefix="email_scheduler_bench_")
+        os.environ["SQLITE_PATH"] = os.path.join(sqlite_dir, "bench.db")
+
+    import api  # noqa: F401  (configures logging)
+    logging.getLogger().setLevel(args.log_level)
+
+    db = await connect(args)
+    try:
+        seed_started = time.perf_counter()
+        users, job_ids = await seed(db, args)
+        seed_elapsed = time.perf_counter() - seed_started
+
+        scheduler_results = await run_scheduler_phase(args)
+        api_results = await run_api_phase(args, users, job_ids)
+    finally:
+        await db.close()
+        server.stop()
+        if args.backend == "sqlite":
+            shutil.rmtree(sqlite_dir, ignore_errors=True)
+
+    return {
+        "benchmark": "email_scheduler_e2e",
+        "timestamp": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "users": args.users,
+            "jobs": args.jobs,
+            "body_bytes": args.body_bytes,
+            "gmail_latency_ms": args.gmail_latency_ms,
+            "error_rate": args.error_rate,
+            "api_requests": args.api_requests,
+            "api_concurrency": args.api_concurrency,
+            "max_jobs_per_tick": args.max_jobs_per_tick,
+            "database": args.backend
+        },
+        "seed_duration_s": round(seed_elapsed, 4),
+        "scheduler": scheduler_results,
+        "api": api_results,
+        "fake_google_requests": dict(server.requests),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+
+# Metrics compared by --compare, with whether higher is better
+COMPARED_METRICS = [
+    ("scheduler.jobs_per_sec", True),
+    ("scheduler.duration_s", False),
+    ("api.requests_per_sec", True),
+    ("api.p50_ms", False),
+    ("api.p99_ms", False),
+    ("peak_rss_mb", False),
+]
+
+
+def lookup(results, dotted):
+    value = results
+    for key in dotted.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    print(f"{'metric':<26}{'baseline':>14}{'candidate':>14}{'change':>10}")
+    for metric, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline, metric), lookup(candidate, metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        marker = "" if abs(change) < 1 else (" +" if better else " -")
+        print(f"{metric:<26}{old:>14}{new:>14}{change:>9.1f}%{marker}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--body-bytes", type=int, default=2000)
+    parser.add_argument("--gmail-latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Gmail sends that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--max-jobs-per-tick", type=int, default=0,
+                        help="Scheduler per-tick cap; 0 sends every seeded job in the one measured tick")
+    parser.add_argument("--api-requests", type=int, default=1000)
+    parser.add_argument("--api-concurrency", type=int, default=20)
+    parser.add_argument("--backend", choices=["mongomock", "mongodb", "sqlite"], default="mongomock",
+                        help="mongomock: in-process stand-in; mongodb: real server at --mongodb-url; sqlite: temporary file")
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="email_scheduler_bench")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ import os
 
 
 class Settings(BaseSettings):
+    # Database backend: "mongodb" or "sqlite"
+    database_backend: str = os.getenv("DATABASE_BACKEND", "mongodb")
+    sqlite_path: str = os.getenv("SQLITE_PATH", "email_scheduler.db")
+    
     # MongoDB Configuration
     mongodb_url: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     mongodb_db: str = os.getenv("MONGODB_DB", "email_scheduler")
@@ -11,11 +15,35 @@ class Settings(BaseSettings):
     # Alternative MongoDB connection for Railway (if main one fails)
     mongodb_url_alt: str = os.getenv("MONGODB_URL_ALT", "")
     
+    # MongoDB connection pools: API requests and background work (scheduler
+    # ticks, token refresh, send history) use separate clients
+    mongo_api_max_pool_size: int = int(os.getenv("MONGO_API_MAX_POOL_SIZE", "20"))
+    mongo_api_min_pool_size: int = int(os.getenv("MONGO_API_MIN_POOL_SIZE", "1"))
+    mongo_api_wait_queue_timeout_ms: int = int(os.getenv("MONGO_API_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+    mongo_scheduler_max_pool_size: int = int(os.getenv("MONGO_SCHEDULER_MAX_POOL_SIZE", "10"))
+    mongo_scheduler_min_pool_size: int = int(os.getenv("MONGO_SCHEDULER_MIN_POOL_SIZE", "0"))
+    mongo_scheduler_wait_queue_timeout_ms: int = int(os.getenv("MONGO_SCHEDULER_WAIT_QUEUE_TIMEOUT_MS", "30000"))
+    mongo_max_idle_time_ms: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+    
     # Google OAuth2 Configuration
     google_client_id: str = os.getenv("GOOGLE_CLIENT_ID", "383809440934-j3j60ub8fmmfgf1b34p65lp5pqvt0g8k.apps.googleusercontent.com")
     google_client_secret: str = os.getenv("GOOGLE_CLIENT_SECRET", "")
     google_redirect_uri: str = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:8000/auth/google/callback")
     
+    # Google endpoints (overridable to point at a fake server for benchmarks)
+    google_auth_uri: str = os.getenv("GOOGLE_AUTH_URI", "https://accounts.google.com/o/oauth2/auth")
+    google_token_uri: str = os.getenv("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+    google_userinfo_url: str = os.getenv("GOOGLE_USERINFO_URL", "https://www.googleapis.com/oauth2/v2/userinfo")
+    gmail_api_endpoint: str = os.getenv("GMAIL_API_ENDPOINT", "")  # empty uses https://gmail.googleapis.com
+    
+    # Shared HTTP client for Google (OAuth, userinfo and Gmail)
+    google_http_timeout_seconds: float = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "10"))
+    google_http_connect_timeout_seconds: float = float(os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+    google_http_max_connections: int = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "100"))
+    google_http_max_keepalive_connections: int = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    google_http_keepalive_expiry_seconds: float = float(os.getenv("GOOGLE_HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+    google_http2_enabled: bool = os.getenv("GOOGLE_HTTP2_ENABLED", "True").lower() == "true"
+    
     # JWT Configuration
     jwt_secret_key: str = os.getenv("JWT_SECRET_KEY", "your_super_secret_jwt_key_that_should_be_at_least_32_characters_long_for_security")
     jwt_algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
@@ -27,9 +55,90 @@ class Settings(BaseSettings):
     host: str = os.getenv("HOST", "0.0.0.0")
     port: int = int(os.getenv("PORT", "8000"))
     
+    # Logging: "json" or "text" lines on stdout, written by a background thread
+    log_level: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    log_format: str = os.getenv("LOG_FORMAT", "json").lower()
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Per-job log lines allowed per second from each call site (0 = no limit)
+    log_hot_path_per_second: int = int(os.getenv("LOG_HOT_PATH_PER_SECOND", "10"))
+    
+    # Health Check Configuration
+    health_refresh_seconds: int = int(os.getenv("HEALTH_REFRESH_SECONDS", "10"))
+    health_db_timeout_seconds: float = float(os.getenv("HEALTH_DB_TIMEOUT_SECONDS", "2"))
+    health_max_scheduler_lag_seconds: int = int(os.getenv("HEALTH_MAX_SCHEDULER_LAG_SECONDS", "300"))
+    
+    # Comma-separated emails of users allowed to use the /debug endpoints
+    admin_emails: str = os.getenv("ADMIN_EMAILS", "")
+    
+    # Profiling Configuration
+    profile_dir: str = os.getenv("PROFILE_DIR", "profiles")
+    profile_top_functions: int = int(os.getenv("PROFILE_TOP_FUNCTIONS", "30"))
+    
     # File Upload Configuration
     max_file_size: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
     upload_dir: str = os.getenv("UPLOAD_DIR", "uploads")
+    # "local" (UPLOAD_DIR, single node) or "gridfs" (MongoDB, shared by every node)
+    attachment_storage: str = os.getenv("ATTACHMENT_STORAGE", "local").lower()
+    attachment_chunk_bytes: int = int(os.getenv("ATTACHMENT_CHUNK_BYTES", "261120"))
+    # Read-through cache of GridFS attachments on sending nodes
+    attachment_cache_dir: str = os.getenv("ATTACHMENT_CACHE_DIR", "attachment_cache")
+    attachment_cache_max_bytes: int = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", "536870912"))  # 512MB
+    
+    # OAuth Token Refresh Configuration
+    token_refresh_interval_seconds: int = int(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "300"))
+    token_refresh_lead_minutes: int = int(os.getenv("TOKEN_REFRESH_LEAD_MINUTES", "15"))
+    token_refresh_batch_size: int = int(os.getenv("TOKEN_REFRESH_BATCH_SIZE", "100"))
+    token_refresh_concurrency: int = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "10"))
+    token_refresh_retry_minutes: int = int(os.getenv("TOKEN_REFRESH_RETRY_MINUTES", "30"))
+    
+    # Send Retry Configuration
+    send_max_attempts: int = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+    send_retry_base_seconds: int = int(os.getenv("SEND_RETRY_BASE_SECONDS", "60"))
+    send_retry_max_seconds: int = int(os.getenv("SEND_RETRY_MAX_SECONDS", "21600"))  # 6 hours
+    
+    # Send dispatch: workers shared by scheduled and send-now sends, send-now first
+    dispatch_workers: int = int(os.getenv("DISPATCH_WORKERS", "1"))
+    send_request_ttl_hours: int = int(os.getenv("SEND_REQUEST_TTL_HOURS", "24"))
+    # How long shutdown waits for in-flight sends; keep below the platform's kill timeout
+    shutdown_drain_seconds: float = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+    
+    # Idempotency-Key handling for POST /jobs and send-now
+    idempotency_key_ttl_hours: int = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+    idempotency_cache_size: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1000"))
+    idempotency_wait_seconds: int = int(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+    
+    # Job archiving: move jobs deleted for longer than the retention period to
+    # email_jobs_archive, in throttled batches
+    job_archive_enabled: bool = os.getenv("JOB_ARCHIVE_ENABLED", "True").lower() == "true"
+    job_archive_retention_days: int = int(os.getenv("JOB_ARCHIVE_RETENTION_DAYS", "30"))
+    job_archive_interval_minutes: int = int(os.getenv("JOB_ARCHIVE_INTERVAL_MINUTES", "60"))
+    job_archive_batch_size: int = int(os.getenv("JOB_ARCHIVE_BATCH_SIZE", "500"))
+    job_archive_batch_pause_seconds: float = float(os.getenv("JOB_ARCHIVE_BATCH_PAUSE_SECONDS", "1.0"))
+    
+    # Job bodies of at least this many bytes are stored zlib-compressed (0 to disable)
+    job_body_compression_threshold_bytes: int = int(os.getenv("JOB_BODY_COMPRESSION_THRESHOLD_BYTES", "4096"))
+    job_body_compression_level: int = int(os.getenv("JOB_BODY_COMPRESSION_LEVEL", "6"))
+    
+    # Most due jobs sent per scheduler tick (0 for no cap); the rest carry over
+    # to later ticks, highest priority and most overdue first
+    scheduler_max_jobs_per_tick: int = int(os.getenv("SCHEDULER_MAX_JOBS_PER_TICK", "500"))
+    
+    # Send-time smoothing: spread new schedules over the least loaded minutes
+    send_smoothing_enabled: bool = os.getenv("SEND_SMOOTHING_ENABLED", "False").lower() == "true"
+    send_smoothing_window_minutes: int = int(os.getenv("SEND_SMOOTHING_WINDOW_MINUTES", "60"))
+    
+    # Scheduler Partitioning: replicas split the due jobs between them by
+    # consistent hashing of user_id instead of all scanning every job
+    scheduler_partitioning_enabled: bool = os.getenv("SCHEDULER_PARTITIONING_ENABLED", "False").lower() == "true"
+    scheduler_worker_id: str = os.getenv("SCHEDULER_WORKER_ID", "")  # empty derives one from host and pid
+    scheduler_heartbeat_seconds: int = int(os.getenv("SCHEDULER_HEARTBEAT_SECONDS", "15"))
+    scheduler_worker_timeout_seconds: int = int(os.getenv("SCHEDULER_WORKER_TIMEOUT_SECONDS", "45"))
+    
+    # Send History Configuration
+    send_history_ttl_days: int = int(os.getenv("SEND_HISTORY_TTL_DAYS", "90"))
+    send_history_batch_size: int = int(os.getenv("SEND_HISTORY_BATCH_SIZE", "100"))
+    send_history_flush_seconds: int = int(os.getenv("SEND_HISTORY_FLUSH_SECONDS", "5"))
+    send_history_max_buffer: int = int(os.getenv("SEND_HISTORY_MAX_BUFFER", "10000"))
     
     class Config:
         env_file = ".env"
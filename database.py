@@ -1,20 +1,406 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING
-from typing import List, Optional
-from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, monitoring
+from typing import Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from enum import Enum
 import logging
 import asyncio
 import ssl
 import os
+import threading
+import time
 from config import settings
-from models import User, EmailJob, EmailJobStatus
+from metrics import (
+    track_db_operation, MONGO_POOL_CHECKED_OUT, MONGO_POOL_WAITERS,
+    MONGO_POOL_WAIT_DURATION, MONGO_POOL_CHECKOUT_FAILURES
+)
+from models import (
+    User, EmailJob, EmailJobStatus, SendHistoryEntry, SendRequest, IdempotencyRecord, DailySendStats
+)
+from partitioning import partition_for_user
+from job_body import BODY_FIELDS, body_storage_fields
 
 logger = logging.getLogger(__name__)
 
+# Applied batch ids each send rollup remembers, to skip retried batches
+ROLLUP_BATCH_IDS_KEPT = 100
+
+
+class Workload(str, Enum):
+    """Traffic class, each with its own connection pool on pooling backends."""
+    API = "api"
+    SCHEDULER = "scheduler"
+
+
+# Workload of the current task; API requests keep the default
+db_workload: ContextVar[Workload] = ContextVar("db_workload", default=Workload.API)
+
+
+def use_scheduler_pool():
+    """Run the current task's database calls on the scheduler connection pool.
+
+    Background services call this at the start of each run. APScheduler runs
+    every job in its own task, so the switch never leaks into API requests.
+    """
+    db_workload.set(Workload.SCHEDULER)
+
+
+class Database(ABC):
+    """Repository interface for users, email jobs and send history.
+
+    ``MongoDatabase`` is the default backend; ``SQLiteDatabase`` (in
+    sqlite_database.py) suits single-node installs and CI. Pick one with the
+    DATABASE_BACKEND setting.
+
+    Every job write that changes a job also increments its owner's
+    ``User.jobs_version``, after the job itself is written, so a client holding
+    the current version is guaranteed to have seen every change.
+    """
+
+    @property
+    @abstractmethod
+    def is_connected(self) -> bool:
+        """Whether the backend is connected and ready for queries."""
+
+    @abstractmethod
+    async def connect(self):
+        """Open the connection and make sure the schema and indexes exist."""
+
+    @abstractmethod
+    async def close(self):
+        """Close the connection."""
+
+    @abstractmethod
+    async def ping(self):
+        """Round-trip to the backend, raising if it is unreachable."""
+
+    def pool_stats(self) -> dict:
+        """Connection pool statistics by workload, for backends that pool connections."""
+        return {}
+
+    # User operations
+    @abstractmethod
+    async def create_user(self, user: User) -> User:
+        """Create a new user."""
+
+    @abstractmethod
+    async def get_user_by_google_id(self, google_id: str) -> Optional[User]:
+        """Get user by Google ID."""
+
+    @abstractmethod
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        """Get user by email."""
+
+    @abstractmethod
+    async def get_user_by_id(self, user_id: str) -> Optional[User]:
+        """Get user by id."""
+
+    @abstractmethod
+    async def update_user_tokens(self, user_id: str, access_token: str, refresh_token: str, token_expiry: datetime):
+        """Update user's OAuth tokens."""
+
+    @abstractmethod
+    async def get_users_with_expiring_tokens(self, expires_before: datetime, retry_before: datetime, limit: int) -> List[User]:
+        """Get users whose access token expires before the given time, soonest first."""
+
+    @abstractmethod
+    async def mark_token_refresh_failed(self, user_id: str):
+        """Record a failed token refresh so the user is retried later."""
+
+    # Email job operations
+    @abstractmethod
+    async def create_email_job(self, email_job: EmailJob) -> EmailJob:
+        """Create a new email job."""
+
+    @abstractmethod
+    async def create_email_jobs(self, email_jobs: List[EmailJob]) -> List[EmailJob]:
+        """Create several email jobs in one batched write."""
+
+    @abstractmethod
+    async def get_user_email_jobs(self, user_id: str, include_body: bool = True) -> List[EmailJob]:
+        """Get all email jobs for a user; without ``include_body`` bodies are not read at all.
+
+        Bodies over JOB_BODY_COMPRESSION_THRESHOLD_BYTES are stored compressed
+        in every backend and decompressed by EmailJob.get_body.
+        """
+
+    @abstractmethod
+    async def get_email_job(self, job_id: str, user_id: str) -> Optional[EmailJob]:
+        """Get a specific email job."""
+
+    @abstractmethod
+    async def update_email_job(self, job_id: str, user_id: str, update_data: dict) -> Optional[EmailJob]:
+        """Update an email job."""
+
+    @abstractmethod
+    async def delete_email_job(self, job_id: str, user_id: str) -> bool:
+        """Soft delete an email job."""
+
+    @abstractmethod
+    async def get_due_email_jobs(self, partitions: Optional[List[int]] = None, limit: Optional[int] = None) -> List[EmailJob]:
+        """Get email jobs that are due to be sent, highest priority then most overdue first.
+
+        ``partitions`` restricts the scan to those scheduler partitions and
+        ``limit`` caps the number of jobs returned.
+        """
+
+    @abstractmethod
+    async def count_due_email_jobs(self, partitions: Optional[List[int]] = None) -> int:
+        """Count the email jobs that are due to be sent."""
+
+    @abstractmethod
+    async def get_send_load(self, start: datetime, end: datetime) -> Dict[datetime, int]:
+        """Count active jobs per minute of next_send in ``[start, end)``."""
+
+    @abstractmethod
+    async def update_job_sent_time(self, job_id: str, sent_time: datetime, next_send: datetime):
+        """Update an active job's last sent time and next send time."""
+
+    @abstractmethod
+    async def record_job_failure(self, job_id: str, attempts: int, error: str, next_send: Optional[datetime], dead_letter: bool = False):
+        """Record a failed send attempt on an active job, either rescheduling or dead-lettering it."""
+
+    # Job archive operations
+    @abstractmethod
+    async def archive_deleted_jobs(self, deleted_before: datetime, limit: int, partitions: Optional[List[int]] = None) -> int:
+        """Move up to ``limit`` jobs deleted before ``deleted_before`` to the archive.
+
+        Returns the number of jobs moved; ``partitions`` restricts it to those
+        scheduler partitions.
+        """
+
+    @abstractmethod
+    async def get_job_storage_stats(self) -> Dict[str, int]:
+        """Bytes used by the email jobs data and its indexes, and the job count; {} if unknown."""
+
+    # Send history operations
+    @abstractmethod
+    async def insert_send_history(self, entries: List[dict]):
+        """Insert a batch of send history entries."""
+
+    @abstractmethod
+    async def get_job_send_history(
+        self,
+        job_id: str,
+        user_id: str,
+        limit: int,
+        before: Optional[Tuple[datetime, str]] = None
+    ) -> List[SendHistoryEntry]:
+        """Get a job's send history, newest first, keyset-paginated on ``(sent_at, id)``."""
+
+    # Send rollup operations
+    @abstractmethod
+    async def increment_send_rollups(self, counts: Dict[Tuple[str, str], Dict[str, int]], batch_id: str):
+        """Add ``{"sent": n, "failed": n}`` counts to each ``(user_id, day)`` rollup, creating missing ones.
+
+        Idempotent per ``batch_id``: retrying a batch that was wholly or partly
+        applied only adds the counts not applied yet.
+        """
+
+    @abstractmethod
+    async def get_send_rollups(self, user_id: str, start_day: date, end_day: date) -> List[DailySendStats]:
+        """Get a user's daily rollups from ``start_day`` to ``end_day`` inclusive; days without sends are omitted."""
+
+    @abstractmethod
+    async def count_pending_jobs(self, user_id: str) -> int:
+        """Count a user's active jobs, each waiting for its next send."""
+
+    # Send request operations
+    @abstractmethod
+    async def create_send_request(self, send_request: SendRequest) -> SendRequest:
+        """Store a new send-now request; old requests expire after SEND_REQUEST_TTL_HOURS."""
+
+    @abstractmethod
+    async def update_send_request(self, send_id: str, update_data: dict):
+        """Update a send-now request."""
+
+    @abstractmethod
+    async def get_send_request(self, send_id: str, user_id: str) -> Optional[SendRequest]:
+        """Get a user's send-now request."""
+
+    # Idempotency key operations
+    @abstractmethod
+    async def claim_idempotency_key(self, record: IdempotencyRecord) -> Optional[IdempotencyRecord]:
+        """Claim a key; returns None if claimed, else the unexpired record that already holds it.
+
+        Keys expire after IDEMPOTENCY_KEY_TTL_HOURS.
+        """
+
+    @abstractmethod
+    async def get_idempotency_key(self, key: str) -> Optional[IdempotencyRecord]:
+        """Get the record holding a key."""
+
+    @abstractmethod
+    async def complete_idempotency_key(self, key: str, status_code: int, response_body: str, headers: Dict[str, str]):
+        """Store the response of the request that claimed a key."""
+
+    @abstractmethod
+    async def release_idempotency_key(self, key: str):
+        """Give up an unfinished claim so the key can be retried."""
+
+    # Scheduler worker operations
+    @abstractmethod
+    async def heartbeat_worker(self, worker_id: str, now: datetime):
+        """Record that a scheduler worker is alive."""
+
+    @abstractmethod
+    async def get_live_workers(self, since: datetime) -> List[str]:
+        """Get the ids of scheduler workers that heartbeated after ``since``."""
+
+    @abstractmethod
+    async def remove_worker(self, worker_id: str):
+        """Forget a scheduler worker that is shutting down."""
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Track checkouts, waiters and checkout wait time of one client's pools.
+
+    pymongo fires the check-out events on the thread running the operation, so
+    the start of each wait is kept thread-local.
+    """
+
+    def __init__(self, workload: Workload):
+        self.workload = workload
+        self.open_connections = 0
+        self.checked_out = 0
+        self.waiters = 0
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._checked_out_gauge = MONGO_POOL_CHECKED_OUT.labels(pool=workload.value)
+        self._waiters_gauge = MONGO_POOL_WAITERS.labels(pool=workload.value)
+        self._wait_histogram = MONGO_POOL_WAIT_DURATION.labels(pool=workload.value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "waiters": self.waiters,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.failures,
+                "avg_wait_ms": round(self.wait_seconds_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 3)
+            }
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiters += 1
+        self._waiters_gauge.inc()
+
+    def connection_checked_out(self, event):
+        waited = time.perf_counter() - getattr(self._local, "started", time.perf_counter())
+        with self._lock:
+            self.waiters -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self._waiters_gauge.dec()
+        self._checked_out_gauge.inc()
+        self._wait_histogram.observe(waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiters -= 1
+            self.failures += 1
+        self._waiters_gauge.dec()
+        MONGO_POOL_CHECKOUT_FAILURES.labels(pool=self.workload.value, reason=event.reason).inc()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+        self._checked_out_gauge.dec()
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+class MongoDatabase(Database):
+    """MongoDB backend with one client (and pool) per workload.
+
+    A large scheduler tick can hold every connection of its pool without
+    making API requests wait, and a burst of API traffic cannot stall a tick.
+    """
 
-class Database:
     client: AsyncIOMotorClient = None
-    db = None
+    scheduler_client: AsyncIOMotorClient = None
+    _api_db = None
+    _scheduler_db = None
+
+    def __init__(self):
+        self.pool_listeners = {workload: PoolStatsListener(workload) for workload in Workload}
+
+    @property
+    def db(self):
+        """Database handle on the current workload's pool."""
+        if db_workload.get() is Workload.SCHEDULER and self._scheduler_db is not None:
+            return self._scheduler_db
+        return self._api_db
+
+    @db.setter
+    def db(self, value):
+        self._api_db = value
+
+    @property
+    def is_connected(self) -> bool:
+        return self._api_db is not None
+
+    def pool_stats(self) -> dict:
+        return {workload.value: listener.snapshot() for workload, listener in self.pool_listeners.items()}
+
+    def _pool_options(self, workload: Workload) -> dict:
+        """Client pool options for a workload, from settings."""
+        if workload is Workload.SCHEDULER:
+            max_pool_size = settings.mongo_scheduler_max_pool_size
+            min_pool_size = settings.mongo_scheduler_min_pool_size
+            wait_queue_timeout_ms = settings.mongo_scheduler_wait_queue_timeout_ms
+        else:
+            max_pool_size = settings.mongo_api_max_pool_size
+            min_pool_size = settings.mongo_api_min_pool_size
+            wait_queue_timeout_ms = settings.mongo_api_wait_queue_timeout_ms
+        return {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms,
+            "maxIdleTimeMS": settings.mongo_max_idle_time_ms,
+            "event_listeners": [self.pool_listeners[workload]]
+        }
+
+    async def connect(self):
+        await self.connect_to_mongo()
+
+    async def close(self):
+        await self.close_mongo_connection()
+
+    async def ping(self):
+        await self.client.admin.command('ping')
 
     async def connect_to_mongo(self):
         """Create database connection with retry logic and multiple fallback strategies."""
@@ -30,9 +416,7 @@ class Database:
                 "config": {
                     "serverSelectionTimeoutMS": 30000,
                     "connectTimeoutMS": 30000,
-                    "socketTimeoutMS": 30000,
-                    "maxPoolSize": 10,
-                    "minPoolSize": 1
+                    "socketTimeoutMS": 30000
                 }
             },
             # Strategy 2: Use connection string with query parameters (no TLS)
@@ -42,9 +426,7 @@ class Database:
                 "config": {
                     "serverSelectionTimeoutMS": 30000,
                     "connectTimeoutMS": 30000,
-                    "socketTimeoutMS": 30000,
-                    "maxPoolSize": 10,
-                    "minPoolSize": 1
+                    "socketTimeoutMS": 30000
                 }
             },
             # Strategy 3: Use connection string with minimal TLS
@@ -117,18 +499,17 @@ class Database:
             for url_index, base_url in enumerate(urls_to_try):
                 for strategy_index, strategy in enumerate(connection_strategies):
                     try:
-                        logger.info(f"Attempting to connect to MongoDB (attempt {attempt + 1}/{max_retries}, URL {url_index + 1}/{len(urls_to_try)}, strategy {strategy_index + 1}/{len(connection_strategies)})")
+                        # URLs and client options are not logged; they carry credentials
+                        logger.info(f"Attempting to connect to MongoDB (attempt {attempt + 1}/{max_retries}, URL {url_index + 1}/{len(urls_to_try)}, strategy {strategy_index + 1}/{len(connection_strategies)}: {strategy['name']})")
                         
                         # Modify URL according to strategy
                         modified_url = strategy["url_modifier"](base_url)
-                        logger.info(f"Strategy: {strategy['name']}")
-                        logger.info(f"Modified URL: {modified_url}")
-                        logger.info(f"Config: {strategy['config']}")
                         
                         # Create client with current strategy
                         self.client = AsyncIOMotorClient(
                             modified_url,
-                            **strategy["config"]
+                            **strategy["config"],
+                            **self._pool_options(Workload.API)
                         )
                         
                         # Test the connection
@@ -136,18 +517,68 @@ class Database:
                         
                         self.db = self.client[settings.mongodb_db]
                         
+                        # Background work gets its own pool, using the URL and strategy that just worked
+                        self.scheduler_client = AsyncIOMotorClient(
+                            modified_url,
+                            **strategy["config"],
+                            **self._pool_options(Workload.SCHEDULER)
+                        )
+                        self._scheduler_db = self.scheduler_client[settings.mongodb_db]
+                        
                         # Create indexes with error handling
                         try:
                             await self.db.users.create_index([("google_id", ASCENDING)], unique=True)
                             await self.db.users.create_index([("email", ASCENDING)], unique=True)
+                            await self.db.users.create_index([("token_expiry", ASCENDING)])
                             await self.db.email_jobs.create_index([("user_id", ASCENDING)])
+                            await self.db.email_jobs.create_index([("user_id", ASCENDING), ("status", ASCENDING)])
                             await self.db.email_jobs.create_index([("next_send", ASCENDING)])
                             await self.db.email_jobs.create_index([("status", ASCENDING)])
+                            await self.db.email_jobs.create_index(
+                                [("status", ASCENDING), ("scheduler_partition", ASCENDING), ("next_send", ASCENDING)]
+                            )
+                            await self.db.email_jobs.create_index(
+                                [("status", ASCENDING), ("priority", DESCENDING), ("next_send", ASCENDING)]
+                            )
+                            # Only deleted jobs are indexed, for the archiver
+                            await self.db.email_jobs.create_index(
+                                [("updated_at", ASCENDING)],
+                                name="deleted_updated_at",
+                                partialFilterExpression={"status": EmailJobStatus.DELETED.value}
+                            )
+                            await self.db.send_history.create_index(
+                                [("sent_at", ASCENDING)],
+                                expireAfterSeconds=settings.send_history_ttl_days * 86400
+                            )
+                            await self.db.send_history.create_index(
+                                [("job_id", ASCENDING), ("sent_at", DESCENDING), ("_id", DESCENDING)]
+                            )
+                            await self.db.send_rollups.create_index(
+                                [("user_id", ASCENDING), ("day", ASCENDING)], unique=True
+                            )
+                            await self.db.send_requests.create_index(
+                                [("created_at", ASCENDING)],
+                                expireAfterSeconds=settings.send_request_ttl_hours * 3600
+                            )
+                            await self.db.idempotency_keys.create_index(
+                                [("created_at", ASCENDING)],
+                                expireAfterSeconds=settings.idempotency_key_ttl_hours * 3600
+                            )
+                            # Workers that died without deregistering are cleaned up after a day
+                            await self.db.scheduler_workers.create_index(
+                                [("heartbeat_at", ASCENDING)],
+                                expireAfterSeconds=86400
+                            )
                             logger.info("Database indexes created successfully")
                         except Exception as index_error:
                             logger.warning(f"Failed to create some indexes: {index_error}")
                             # Continue even if index creation fails
                         
+                        try:
+                            await self._backfill_job_fields()
+                        except Exception as backfill_error:
+                            logger.warning(f"Failed to backfill job fields: {backfill_error}")
+                        
                         logger.info(f"Successfully connected to MongoDB using URL {url_index + 1} and strategy {strategy_index + 1}")
                         return
                         
@@ -156,6 +587,11 @@ class Database:
                         if self.client:
                             self.client.close()
                             self.client = None
+                        if self.scheduler_client:
+                            self.scheduler_client.close()
+                            self.scheduler_client = None
+                            self._scheduler_db = None
+                        self.db = None
                         continue
             
             # If all strategies failed, wait and retry
@@ -170,13 +606,33 @@ class Database:
                 logger.warning("Application will start without database connection. Health check will show degraded status.")
                 return
 
+    async def _backfill_job_fields(self):
+        """Set fields that jobs created by older versions lack."""
+        # Missing priorities would sort after every priority 0 job
+        await self.db.email_jobs.update_many(
+            {"priority": {"$exists": False}},
+            {"$set": {"priority": 0}}
+        )
+        
+        user_ids = await self.db.email_jobs.distinct("user_id", {"scheduler_partition": {"$exists": False}})
+        for user_id in user_ids:
+            await self.db.email_jobs.update_many(
+                {"user_id": user_id, "scheduler_partition": {"$exists": False}},
+                {"$set": {"scheduler_partition": partition_for_user(user_id)}}
+            )
+        if user_ids:
+            logger.info(f"Backfilled job partitions for {len(user_ids)} user(s)")
+
     async def close_mongo_connection(self):
         """Close database connection."""
+        if self.scheduler_client:
+            self.scheduler_client.close()
         if self.client:
             self.client.close()
             logger.info("Closed MongoDB connection")
 
     # User operations
+    @track_db_operation
     async def create_user(self, user: User) -> User:
         """Create a new user."""
         user_dict = user.dict()
@@ -187,6 +643,7 @@ class Database:
         user_dict["id"] = str(result.inserted_id)
         return User(**user_dict)
 
+    @track_db_operation
     async def get_user_by_google_id(self, google_id: str) -> Optional[User]:
         """Get user by Google ID."""
         user_dict = await self.db.users.find_one({"google_id": google_id})
@@ -195,6 +652,7 @@ class Database:
             return User(**user_dict)
         return None
 
+    @track_db_operation
     async def get_user_by_email(self, email: str) -> Optional[User]:
         """Get user by email."""
         user_dict = await self.db.users.find_one({"email": email})
@@ -203,6 +661,7 @@ class Database:
             return User(**user_dict)
         return None
 
+    @track_db_operation
     async def get_user_by_id(self, user_id: str) -> Optional[User]:
         """Get user by MongoDB _id."""
         from bson import ObjectId
@@ -215,66 +674,160 @@ class Database:
             logger.error(f"Error getting user by id {user_id}: {e}")
         return None
 
+    @track_db_operation
     async def update_user_tokens(self, user_id: str, access_token: str, refresh_token: str, token_expiry: datetime):
         """Update user's OAuth tokens."""
+        from bson import ObjectId
+        update = {
+            "access_token": access_token,
+            "token_expiry": token_expiry,
+            "token_refresh_failed_at": None,
+            "updated_at": datetime.utcnow()
+        }
+        # Google usually omits the refresh token on refresh; keep the stored one
+        if refresh_token:
+            update["refresh_token"] = refresh_token
         await self.db.users.update_one(
-            {"_id": user_id},
-            {
-                "$set": {
-                    "access_token": access_token,
-                    "refresh_token": refresh_token,
-                    "token_expiry": token_expiry,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+            {"_id": ObjectId(user_id)},
+            {"$set": update}
+        )
+
+    @track_db_operation
+    async def get_users_with_expiring_tokens(self, expires_before: datetime, retry_before: datetime, limit: int) -> List[User]:
+        """Get users whose access token expires before the given time, soonest first.
+
+        Users whose last refresh failed after ``retry_before`` are skipped so a
+        revoked grant is not retried on every pass.
+        """
+        cursor = self.db.users.find({
+            "token_expiry": {"$lte": expires_before},
+            "refresh_token": {"$ne": None},
+            "$or": [
+                {"token_refresh_failed_at": None},
+                {"token_refresh_failed_at": {"$lte": retry_before}}
+            ]
+        }).sort("token_expiry", ASCENDING).limit(limit)
+        users = []
+        async for user_dict in cursor:
+            user_dict["id"] = str(user_dict["_id"])
+            users.append(User(**user_dict))
+        return users
+
+    @track_db_operation
+    async def mark_token_refresh_failed(self, user_id: str):
+        """Record a failed token refresh so the user is retried later."""
+        from bson import ObjectId
+        await self.db.users.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"token_refresh_failed_at": datetime.utcnow()}}
         )
 
     # Email job operations
+    async def _bump_jobs_version(self, *user_ids: str):
+        """Increment the jobs version of the given users."""
+        from bson import ObjectId
+        object_ids = [ObjectId(user_id) for user_id in set(user_ids)]
+        await self.db.users.update_many(
+            {"_id": {"$in": object_ids}},
+            {"$inc": {"jobs_version": 1}}
+        )
+
+    async def _update_active_job_by_id(self, job_id: str, update: dict):
+        """Update a job by id alone, if still active, and bump its owner's jobs version.
+
+        A job paused or deleted while its send was in flight keeps its state.
+        """
+        from bson import ObjectId
+        job_dict = await self.db.email_jobs.find_one_and_update(
+            {"_id": ObjectId(job_id), "status": EmailJobStatus.ACTIVE},
+            {"$set": update},
+            projection={"user_id": 1}
+        )
+        if job_dict:
+            await self._bump_jobs_version(job_dict["user_id"])
+
+    @track_db_operation
     async def create_email_job(self, email_job: EmailJob) -> EmailJob:
         """Create a new email job."""
         job_dict = email_job.dict()
+        job_dict.update(body_storage_fields(job_dict["body"]))
+        job_dict["scheduler_partition"] = partition_for_user(email_job.user_id)
         job_dict["created_at"] = datetime.utcnow()
         job_dict["updated_at"] = datetime.utcnow()
         
         result = await self.db.email_jobs.insert_one(job_dict)
+        await self._bump_jobs_version(email_job.user_id)
         job_dict["id"] = str(result.inserted_id)
-        return EmailJob(**job_dict)
+        return EmailJob.from_trusted(job_dict)
+
+    @track_db_operation
+    async def create_email_jobs(self, email_jobs: List[EmailJob]) -> List[EmailJob]:
+        """Create several email jobs in one batched write."""
+        if not email_jobs:
+            return []
+        now = datetime.utcnow()
+        job_dicts = []
+        for email_job in email_jobs:
+            job_dict = email_job.dict()
+            job_dict.update(body_storage_fields(job_dict["body"]))
+            job_dict["scheduler_partition"] = partition_for_user(email_job.user_id)
+            job_dict["created_at"] = now
+            job_dict["updated_at"] = now
+            job_dicts.append(job_dict)
+        
+        result = await self.db.email_jobs.insert_many(job_dicts)
+        await self._bump_jobs_version(*(email_job.user_id for email_job in email_jobs))
+        jobs = []
+        for job_dict, inserted_id in zip(job_dicts, result.inserted_ids):
+            job_dict["id"] = str(inserted_id)
+            jobs.append(EmailJob.from_trusted(job_dict))
+        return jobs
 
-    async def get_user_email_jobs(self, user_id: str) -> List[EmailJob]:
-        """Get all email jobs for a user."""
-        cursor = self.db.email_jobs.find({"user_id": user_id, "status": {"$ne": EmailJobStatus.DELETED}})
+    @track_db_operation
+    async def get_user_email_jobs(self, user_id: str, include_body: bool = True) -> List[EmailJob]:
+        """Get all email jobs for a user, optionally leaving the bodies on the server."""
+        cursor = self.db.email_jobs.find(
+            {"user_id": user_id, "status": {"$ne": EmailJobStatus.DELETED}},
+            projection=None if include_body else {field: 0 for field in BODY_FIELDS}
+        )
         jobs = []
         async for job_dict in cursor:
             job_dict["id"] = str(job_dict["_id"])
-            jobs.append(EmailJob(**job_dict))
+            jobs.append(EmailJob.from_trusted(job_dict))
         return jobs
 
+    @track_db_operation
     async def get_email_job(self, job_id: str, user_id: str) -> Optional[EmailJob]:
         """Get a specific email job."""
         from bson import ObjectId
         job_dict = await self.db.email_jobs.find_one({"_id": ObjectId(job_id), "user_id": user_id})
         if job_dict:
             job_dict["id"] = str(job_dict["_id"])
-            return EmailJob(**job_dict)
+            return EmailJob.from_trusted(job_dict)
         return None
 
+    @track_db_operation
     async def update_email_job(self, job_id: str, user_id: str, update_data: dict) -> Optional[EmailJob]:
         """Update an email job."""
         from bson import ObjectId
+        if "body" in update_data:
+            update_data.update(body_storage_fields(update_data["body"]))
         update_data["updated_at"] = datetime.utcnow()
         result = await self.db.email_jobs.update_one(
             {"_id": ObjectId(job_id), "user_id": user_id},
             {"$set": update_data}
         )
         if result.modified_count > 0:
+            await self._bump_jobs_version(user_id)
             return await self.get_email_job(job_id, user_id)
         return None
 
+    @track_db_operation
     async def delete_email_job(self, job_id: str, user_id: str) -> bool:
         """Soft delete an email job."""
         from bson import ObjectId
         result = await self.db.email_jobs.update_one(
-            {"_id": ObjectId(job_id), "user_id": user_id},
+            {"_id": ObjectId(job_id), "user_id": user_id, "status": {"$ne": EmailJobStatus.DELETED}},
             {
                 "$set": {
                     "status": EmailJobStatus.DELETED,
@@ -282,38 +835,307 @@ class Database:
                 }
             }
         )
-        return result.modified_count > 0
+        if result.modified_count > 0:
+            await self._bump_jobs_version(user_id)
+            return True
+        return False
 
-    async def get_due_email_jobs(self) -> List[EmailJob]:
-        """Get all email jobs that are due to be sent."""
-        now = datetime.utcnow()
-        cursor = self.db.email_jobs.find({
+    def _due_query(self, partitions: Optional[List[int]]) -> dict:
+        query = {
             "status": EmailJobStatus.ACTIVE,
             "$or": [
-                {"next_send": {"$lte": now}},
+                {"next_send": {"$lte": datetime.utcnow()}},
                 {"next_send": None}
             ]
-        })
+        }
+        if partitions is not None:
+            query["scheduler_partition"] = {"$in": partitions}
+        return query
+
+    @track_db_operation
+    async def get_due_email_jobs(self, partitions: Optional[List[int]] = None, limit: Optional[int] = None) -> List[EmailJob]:
+        """Get email jobs that are due to be sent, highest priority then most overdue first."""
+        cursor = self.db.email_jobs.find(self._due_query(partitions)).sort(
+            [("priority", DESCENDING), ("next_send", ASCENDING)]
+        )
+        if limit:
+            cursor = cursor.limit(limit)
         jobs = []
         async for job_dict in cursor:
             job_dict["id"] = str(job_dict["_id"])
-            jobs.append(EmailJob(**job_dict))
+            jobs.append(EmailJob.from_trusted(job_dict))
         return jobs
 
+    @track_db_operation
+    async def count_due_email_jobs(self, partitions: Optional[List[int]] = None) -> int:
+        """Count the email jobs that are due to be sent."""
+        return await self.db.email_jobs.count_documents(self._due_query(partitions))
+
+    @track_db_operation
+    async def get_send_load(self, start: datetime, end: datetime) -> Dict[datetime, int]:
+        """Count active jobs per minute of next_send in ``[start, end)``."""
+        cursor = self.db.email_jobs.aggregate([
+            {"$match": {"status": EmailJobStatus.ACTIVE, "next_send": {"$gte": start, "$lt": end}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": "%Y-%m-%dT%H:%M", "date": "$next_send"}},
+                "count": {"$sum": 1}
+            }}
+        ])
+        return {datetime.fromisoformat(bucket["_id"]): bucket["count"] async for bucket in cursor}
+
+    @track_db_operation
     async def update_job_sent_time(self, job_id: str, sent_time: datetime, next_send: datetime):
         """Update job's last sent time and next send time."""
+        await self._update_active_job_by_id(job_id, {
+            "last_sent": sent_time,
+            "next_send": next_send,
+            "attempts": 0,
+            "last_error": None,
+            "updated_at": datetime.utcnow()
+        })
+
+    @track_db_operation
+    async def record_job_failure(self, job_id: str, attempts: int, error: str, next_send: Optional[datetime], dead_letter: bool = False):
+        """Record a failed send attempt on an active job, either rescheduling or dead-lettering it."""
+        update = {
+            "attempts": attempts,
+            "last_error": error,
+            "next_send": next_send,
+            "updated_at": datetime.utcnow()
+        }
+        if dead_letter:
+            update["status"] = EmailJobStatus.FAILED
+        await self._update_active_job_by_id(job_id, update)
+
+    # Job archive operations
+    @track_db_operation
+    async def archive_deleted_jobs(self, deleted_before: datetime, limit: int, partitions: Optional[List[int]] = None) -> int:
+        """Move up to ``limit`` jobs deleted before ``deleted_before`` to email_jobs_archive."""
+        from pymongo import ReplaceOne
+        # The status equality matches the partial index's filter, so the planner can
+        # use deleted_updated_at. No hint: if that index failed to build, this still runs.
+        query = {"status": EmailJobStatus.DELETED.value, "updated_at": {"$lt": deleted_before}}
+        if partitions is not None:
+            query["scheduler_partition"] = {"$in": partitions}
+        jobs = await self.db.email_jobs.find(query).limit(limit).to_list(length=limit)
+        if not jobs:
+            return 0
+        archived_at = datetime.utcnow()
+        # Upserts, so a batch interrupted between the two writes is simply redone
+        await self.db.email_jobs_archive.bulk_write(
+            [ReplaceOne({"_id": job["_id"]}, {**job, "archived_at": archived_at}, upsert=True) for job in jobs],
+            ordered=False
+        )
+        result = await self.db.email_jobs.delete_many(
+            {"_id": {"$in": [job["_id"] for job in jobs]}, "status": EmailJobStatus.DELETED}
+        )
+        return result.deleted_count
+
+    @track_db_operation
+    async def get_job_storage_stats(self) -> Dict[str, int]:
+        """Bytes used by the email_jobs documents and indexes, and the job count."""
+        stats = await self.db.command("collStats", "email_jobs")
+        return {
+            "collection_bytes": stats.get("size", 0),
+            "index_bytes": stats.get("totalIndexSize", 0),
+            "jobs": stats.get("count", 0)
+        }
+
+    # Send history operations
+    @track_db_operation
+    async def insert_send_history(self, entries: List[dict]):
+        """Insert a batch of send history entries."""
+        await self.db.send_history.insert_many(entries, ordered=False)
+
+    @track_db_operation
+    async def get_job_send_history(
+        self,
+        job_id: str,
+        user_id: str,
+        limit: int,
+        before: Optional[Tuple[datetime, str]] = None
+    ) -> List[SendHistoryEntry]:
+        """Get a job's send history, newest first.
+
+        Pages are keyset-based: ``before`` is the ``(sent_at, id)`` of the last
+        entry of the previous page, so each page is a single index range scan.
+        """
         from bson import ObjectId
-        await self.db.email_jobs.update_one(
-            {"_id": ObjectId(job_id)},
-            {
-                "$set": {
-                    "last_sent": sent_time,
-                    "next_send": next_send,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+        query = {"job_id": job_id, "user_id": user_id}
+        if before:
+            before_sent_at, before_id = before
+            query["$or"] = [
+                {"sent_at": {"$lt": before_sent_at}},
+                {"sent_at": before_sent_at, "_id": {"$lt": ObjectId(before_id)}}
+            ]
+        cursor = self.db.send_history.find(query).sort(
+            [("sent_at", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit)
+        entries = []
+        async for entry_dict in cursor:
+            entry_dict["id"] = str(entry_dict["_id"])
+            entries.append(SendHistoryEntry(**entry_dict))
+        return entries
+
+    # Send rollup operations
+    @track_db_operation
+    async def increment_send_rollups(self, counts: Dict[Tuple[str, str], Dict[str, int]], batch_id: str):
+        """Add counts to each ``(user_id, day)`` rollup with one unordered batch of $inc upserts.
+
+        Each rollup keeps the ids of the last ROLLUP_BATCH_IDS_KEPT batches
+        applied to it, and skips a batch it already has.
+        """
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        updated_at = datetime.utcnow()
+        keys = list(counts)
+
+        def increments(upsert: bool) -> list:
+            return [
+                UpdateOne(
+                    {"user_id": user_id, "day": day, "batch_ids": {"$ne": batch_id}},
+                    {
+                        "$inc": counts[(user_id, day)],
+                        "$set": {"updated_at": updated_at},
+                        "$push": {"batch_ids": {"$each": [batch_id], "$slice": -ROLLUP_BATCH_IDS_KEPT}}
+                    },
+                    upsert=upsert
+                )
+                for user_id, day in keys
+            ]
+
+        try:
+            await self.db.send_rollups.bulk_write(increments(upsert=True), ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # A duplicate key means the rollup exists: it either already has this
+            # batch, or another replica created it first. Update without upserting.
+            keys = [keys[error["index"]] for error in errors]
+            await self.db.send_rollups.bulk_write(increments(upsert=False), ordered=False)
+
+    @track_db_operation
+    async def get_send_rollups(self, user_id: str, start_day: date, end_day: date) -> List[DailySendStats]:
+        """Get a user's daily rollups from ``start_day`` to ``end_day`` inclusive."""
+        cursor = self.db.send_rollups.find(
+            {"user_id": user_id, "day": {"$gte": start_day.isoformat(), "$lte": end_day.isoformat()}}
+        ).sort("day", ASCENDING)
+        return [
+            DailySendStats(date=rollup["day"], sent=rollup.get("sent", 0), failed=rollup.get("failed", 0))
+            async for rollup in cursor
+        ]
+
+    @track_db_operation
+    async def count_pending_jobs(self, user_id: str) -> int:
+        """Count a user's active jobs."""
+        return await self.db.email_jobs.count_documents({"user_id": user_id, "status": EmailJobStatus.ACTIVE})
+
+    # Send request operations
+    @track_db_operation
+    async def create_send_request(self, send_request: SendRequest) -> SendRequest:
+        """Store a new send-now request."""
+        request_dict = send_request.dict(exclude={"id"})
+        result = await self.db.send_requests.insert_one(request_dict)
+        request_dict["id"] = str(result.inserted_id)
+        return SendRequest(**request_dict)
+
+    @track_db_operation
+    async def update_send_request(self, send_id: str, update_data: dict):
+        """Update a send-now request."""
+        from bson import ObjectId
+        await self.db.send_requests.update_one({"_id": ObjectId(send_id)}, {"$set": update_data})
+
+    @track_db_operation
+    async def get_send_request(self, send_id: str, user_id: str) -> Optional[SendRequest]:
+        """Get a user's send-now request."""
+        from bson import ObjectId
+        request_dict = await self.db.send_requests.find_one({"_id": ObjectId(send_id), "user_id": user_id})
+        if request_dict:
+            request_dict["id"] = str(request_dict["_id"])
+            return SendRequest(**request_dict)
+        return None
+
+    # Idempotency key operations
+    def _to_idempotency_record(self, record_dict: dict) -> IdempotencyRecord:
+        record_dict["key"] = record_dict.pop("_id")
+        return IdempotencyRecord(**record_dict)
+
+    @track_db_operation
+    async def claim_idempotency_key(self, record: IdempotencyRecord) -> Optional[IdempotencyRecord]:
+        """Claim a key; returns None if claimed, else the unexpired record that already holds it."""
+        from pymongo.errors import DuplicateKeyError
+        record_dict = record.dict(exclude={"key"})
+        record_dict["_id"] = record.key
+        # The TTL monitor only runs once a minute, so drop an expired holder first
+        expired_before = datetime.utcnow() - timedelta(hours=settings.idempotency_key_ttl_hours)
+        await self.db.idempotency_keys.delete_one({"_id": record.key, "created_at": {"$lt": expired_before}})
+        while True:
+            try:
+                await self.db.idempotency_keys.insert_one(record_dict)
+                return None
+            except DuplicateKeyError:
+                existing = await self.db.idempotency_keys.find_one({"_id": record.key})
+                if existing:
+                    return self._to_idempotency_record(existing)
+                # Released between the insert and the read; try again
+
+    @track_db_operation
+    async def get_idempotency_key(self, key: str) -> Optional[IdempotencyRecord]:
+        """Get the record holding a key."""
+        record_dict = await self.db.idempotency_keys.find_one({"_id": key})
+        return self._to_idempotency_record(record_dict) if record_dict else None
+
+    @track_db_operation
+    async def complete_idempotency_key(self, key: str, status_code: int, response_body: str, headers: Dict[str, str]):
+        """Store the response of the request that claimed a key."""
+        await self.db.idempotency_keys.update_one(
+            {"_id": key},
+            {"$set": {
+                "status_code": status_code,
+                "response_body": response_body,
+                "headers": headers,
+                "completed_at": datetime.utcnow()
+            }}
+        )
+
+    @track_db_operation
+    async def release_idempotency_key(self, key: str):
+        """Give up an unfinished claim so the key can be retried."""
+        await self.db.idempotency_keys.delete_one({"_id": key, "completed_at": None})
+
+    # Scheduler worker operations
+    @track_db_operation
+    async def heartbeat_worker(self, worker_id: str, now: datetime):
+        """Record that a scheduler worker is alive."""
+        await self.db.scheduler_workers.update_one(
+            {"_id": worker_id},
+            {"$set": {"heartbeat_at": now}},
+            upsert=True
         )
 
+    @track_db_operation
+    async def get_live_workers(self, since: datetime) -> List[str]:
+        """Get the ids of scheduler workers that heartbeated after ``since``."""
+        cursor = self.db.scheduler_workers.find({"heartbeat_at": {"$gt": since}}, {"_id": 1})
+        return [worker["_id"] async for worker in cursor]
+
+    @track_db_operation
+    async def remove_worker(self, worker_id: str):
+        """Forget a scheduler worker that is shutting down."""
+        await self.db.scheduler_workers.delete_one({"_id": worker_id})
+
+
+def create_database() -> Database:
+    """Create the database backend selected by the DATABASE_BACKEND setting."""
+    backend = settings.database_backend.lower()
+    if backend == "sqlite":
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase(settings.sqlite_path)
+    if backend != "mongodb":
+        raise ValueError(f"Unknown DATABASE_BACKEND: {settings.database_backend}")
+    return MongoDatabase()
+
 
 # Create database instance
-db = Database() 
\ No newline at end of file
+db = create_database() 
\ No newline at end of file
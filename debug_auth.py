@@ -72,12 +72,12 @@ if __name__ == "__main__":
     
     # Initialize database connection
     async def main():
-        await db.connect_to_mongo()
+        await db.connect()
         user = await test_token_exchange(code)
         if user:
             print(f"🎉 Success! User: {user.email}")
         else:
             print("❌ Failed to process authentication")
-        await db.close_mongo_connection()
+        await db.close()
     
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,159 @@
+from enum import IntEnum
+from typing import Awaitable, Callable, List, Optional, Set
+import asyncio
+import itertools
+import logging
+from config import settings
+from database import db_workload
+from metrics import DISPATCH_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class SendLane(IntEnum):
+    """Dispatch lanes; lower values are always served first."""
+    INTERACTIVE = 0
+    SCHEDULED = 1
+
+
+class _DispatchItem:
+    def __init__(self, lane: SendLane, run: Callable[[], Awaitable], on_abandon: Optional[Callable[[], Awaitable]]):
+        self.lane = lane
+        self.run = run
+        self.on_abandon = on_abandon
+        # Workers run the item on the submitter's connection pool
+        self.workload = db_workload.get()
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class SendDispatcher:
+    """Run email sends on a fixed pool of workers, interactive sends first.
+
+    Scheduler ticks queue their due jobs in the scheduled lane; send-now
+    requests go in the interactive lane and are picked up by the next free
+    worker, however long the scheduled backlog is.
+    """
+
+    def __init__(self):
+        self.is_running = False
+        self.draining = False
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._in_flight: Set[_DispatchItem] = set()
+        self._sequence = itertools.count()
+        self._depth = {lane: DISPATCH_QUEUE_DEPTH.labels(lane=lane.name.lower()) for lane in SendLane}
+
+    async def start(self):
+        """Start the dispatch workers."""
+        if not self.is_running:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._work()) for _ in range(settings.dispatch_workers)]
+            self.is_running = True
+            self.draining = False
+            logger.info(f"Send dispatcher started with {settings.dispatch_workers} worker(s)")
+
+    async def stop(self):
+        """Stop the workers and abandon whatever is still queued."""
+        if self.is_running or self.draining:
+            self.is_running = False
+            self.draining = False
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+            await self._abandon_queued()
+            logger.info("Send dispatcher stopped")
+
+    async def drain(self, timeout: float) -> bool:
+        """Stop taking sends, hand back queued ones and wait for those in flight.
+
+        Queued scheduled jobs are simply not sent, so they stay due; queued
+        send-now requests are abandoned. Returns False if sends were still in
+        flight after ``timeout`` seconds; ``stop`` cancels those.
+        """
+        if not self.is_running:
+            return True
+        self.is_running = False
+        self.draining = True
+        await self._abandon_queued()
+        in_flight = [item.done for item in self._in_flight]
+        if not in_flight:
+            return True
+        logger.info(f"Waiting up to {timeout}s for {len(in_flight)} in-flight send(s)")
+        _, pending = await asyncio.wait(in_flight, timeout=timeout)
+        if pending:
+            logger.warning(f"{len(pending)} send(s) still in flight after {timeout}s; they will be cancelled")
+            return False
+        return True
+
+    def submit(
+        self,
+        lane: SendLane,
+        run: Callable[[], Awaitable],
+        on_abandon: Optional[Callable[[], Awaitable]] = None
+    ) -> asyncio.Future:
+        """Queue a send; the returned future resolves once a worker has run it."""
+        if not self.is_running:
+            raise RuntimeError("Send dispatcher is not running")
+        item = _DispatchItem(lane, run, on_abandon)
+        self._queue.put_nowait((lane, next(self._sequence), item))
+        self._depth[lane].inc()
+        return item.done
+
+    async def run_scheduled(self, jobs: list, send: Callable[[object], Awaitable]):
+        """Send a tick's jobs in the scheduled lane and wait for all of them.
+
+        Runs them inline when the dispatcher is not running, e.g. in scripts
+        that drive the scheduler directly. While draining, the jobs are not
+        sent at all and stay due for the next replica.
+        """
+        if self.draining:
+            logger.info(f"Send dispatcher is draining; handing back {len(jobs)} due job(s)")
+            return
+        if not self.is_running:
+            for job in jobs:
+                await send(job)
+            return
+        done = [self.submit(SendLane.SCHEDULED, lambda job=job: send(job)) for job in jobs]
+        await asyncio.gather(*done, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            _, _, item = await self._queue.get()
+            self._depth[item.lane].dec()
+            db_workload.set(item.workload)
+            self._in_flight.add(item)
+            try:
+                result = await item.run()
+            except asyncio.CancelledError:
+                await self._abandon(item)
+                raise
+            except Exception as e:
+                logger.error(f"Dispatched send failed: {e}")
+                # The submitter may have stopped waiting, e.g. a cancelled tick
+                if not item.done.done():
+                    item.done.set_exception(e)
+            else:
+                if not item.done.done():
+                    item.done.set_result(result)
+            finally:
+                self._in_flight.discard(item)
+
+    async def _abandon_queued(self):
+        while not self._queue.empty():
+            _, _, item = self._queue.get_nowait()
+            self._depth[item.lane].dec()
+            await self._abandon(item)
+
+    async def _abandon(self, item: _DispatchItem):
+        if item.on_abandon is not None:
+            try:
+                await item.on_abandon()
+            except Exception as e:
+                logger.error(f"Failed to abandon dispatched send: {e}")
+        if not item.done.done():
+            item.done.cancel()
+
+
+# Create send dispatcher instance
+send_dispatcher = SendDispatcher()
@@ -5,24 +5,93 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
+import time
+import httpx
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from fastapi import HTTPException, status
 from config import settings
 from models import EmailJob, EmailSendResult
 from auth import google_oauth2
-from google.auth.transport.requests import Request
+from database import db
+from google_http import google_http
+from attachments import attachment_storage, AttachmentNotFoundError
+from logging_setup import hot_path
+from send_history import send_history
+from metrics import SEND_PHASE_DURATION, SENDS_IN_FLIGHT, SENDS_TOTAL
 
 logger = logging.getLogger(__name__)
 
+# Gmail statuses worth retrying: request timeout, rate limiting and server errors
+RETRYABLE_HTTP_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# 403 error reasons for rate limits and quotas, which clear up on their own
+RETRYABLE_403_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "dailyLimitExceeded", "quotaExceeded"}
+
+# Gmail REST API root when GMAIL_API_ENDPOINT is not set
+GMAIL_API_ROOT = "https://gmail.googleapis.com"
+
+
+class InvalidMessageError(Exception):
+    """The job's message cannot be built; it will fail the same way on every attempt."""
+
+
+def _error_reasons(response: httpx.Response) -> set:
+    """The ``error.errors[].reason`` values of a Google API error response."""
+    try:
+        errors = response.json().get("error", {}).get("errors", [])
+        return {item.get("reason") for item in errors if isinstance(item, dict)}
+    except (ValueError, AttributeError):
+        return set()
+
+
+def classify_send_error(error: Exception) -> tuple:
+    """Classify a send failure as ``(error_class, retryable)``.
+
+    Permanent errors (revoked grants, rejected messages) will fail the same way
+    on every attempt, so they should not be retried.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        if str(error.request.url) == settings.google_token_uri:
+            # Grant rejections are raised as TokenGrantError, so this is transient
+            return f"token_endpoint_{status_code}", True
+        if status_code in RETRYABLE_HTTP_STATUSES:
+            return f"gmail_{status_code}", True
+        # Gmail reports rate limits and exhausted quotas as 403 with one of these reasons
+        if status_code == 403 and _error_reasons(error.response) & RETRYABLE_403_REASONS:
+            return "gmail_rate_limited", True
+        return f"gmail_{status_code}", False
+    if isinstance(error, HTTPException):
+        # A 401 is raised when the stored credentials can no longer be refreshed
+        if error.status_code == status.HTTP_401_UNAUTHORIZED:
+            return "auth_failed", False
+        return "google_api_error", True
+    if isinstance(error, (InvalidMessageError, AttachmentNotFoundError)):
+        return "invalid_message", False
+    return type(error).__name__, True
+
 
 class EmailService:
     def __init__(self):
         self.scope = ['https://www.googleapis.com/auth/gmail.send']
 
+    async def _gmail_request(self, method: str, path: str, access_token: str, body: Optional[dict] = None) -> dict:
+        """Call the Gmail REST API over the shared Google HTTP client.
+
+        Raises httpx.HTTPStatusError for error responses.
+        """
+        root = (settings.gmail_api_endpoint or GMAIL_API_ROOT).rstrip("/")
+        response = await google_http.client.request(
+            method,
+            f"{root}/gmail/v1/users/me/{path}",
+            headers={"Authorization": f"Bearer {access_token}"},
+            json=body
+        )
+        response.raise_for_status()
+        return response.json()
+
     def _create_message(self, sender: str, to: str, subject: str, body: str, attachments: List[str] = None) -> dict:
         """Create a Gmail message with optional attachments."""
         message = MIMEMultipart()
@@ -41,72 +110,122 @@ class EmailService:
                     with open(attachment_path, 'rb') as attachment:
                         part = MIMEBase('application', 'octet-stream')
                         part.set_payload(attachment.read())
-                    
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename= {attachment_path.split("/")[-1]}'
-                    )
-                    message.attach(part)
-                except Exception as e:
-                    logger.warning(f"Failed to attach file {attachment_path}: {e}")
+                except OSError as e:
+                    # Never send the email without one of its attachments
+                    raise AttachmentNotFoundError(f"Failed to attach file {attachment_path}: {e}") from e
+                
+                encoders.encode_base64(part)
+                part.add_header(
+                    'Content-Disposition',
+                    f'attachment; filename= {attachment_path.split("/")[-1]}'
+                )
+                message.attach(part)
 
         # Encode the message
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
         return {'raw': raw_message}
 
-    async def _get_valid_credentials(self, user_access_token: str, user_refresh_token: str) -> Credentials:
-        """Get valid credentials, refreshing if necessary."""
+    async def _get_valid_credentials(self, user_access_token: str, user_refresh_token: str, token_expiry: Optional[datetime] = None) -> Credentials:
+        """Get valid credentials, refreshing if necessary.
+
+        Tokens are normally kept fresh by the background token refresher; the
+        inline refresh here is only a fallback for tokens it has not reached yet.
+        """
         credentials = Credentials(
             token=user_access_token,
             refresh_token=user_refresh_token,
-            token_uri="https://oauth2.googleapis.com/token",
+            token_uri=settings.google_token_uri,
             client_id=settings.google_client_id,
             client_secret=settings.google_client_secret,
-            scopes=self.scope
+            scopes=self.scope,
+            expiry=token_expiry
         )
 
         # Check if token is expired
         if credentials.expired:
             try:
-                credentials.refresh(Request())
+                tokens = await google_oauth2.refresh_access_token(user_refresh_token)
+                credentials = Credentials(
+                    token=tokens["access_token"],
+                    refresh_token=tokens["refresh_token"],
+                    token_uri=settings.google_token_uri,
+                    client_id=settings.google_client_id,
+                    client_secret=settings.google_client_secret,
+                    scopes=self.scope,
+                    expiry=tokens["expiry"]
+                )
                 logger.info("Access token refreshed successfully")
-            except Exception as e:
-                logger.error(f"Failed to refresh access token: {e}")
+            except HTTPException as e:
+                # Google rejected the refresh token; only re-authentication helps
+                logger.error(f"Failed to refresh access token: {e.detail}")
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Failed to refresh access token. Please re-authenticate."
                 )
+            # Timeouts, connection errors and 5xx propagate and are retried with backoff
 
         return credentials
 
-    async def send_email(self, email_job: EmailJob, user_access_token: str, user_refresh_token: str) -> EmailSendResult:
+    async def send_email(self, email_job: EmailJob, user_access_token: str, user_refresh_token: str, token_expiry: Optional[datetime] = None) -> EmailSendResult:
+        """Send an email using Gmail API and record the outcome in the send history."""
+        started = time.perf_counter()
+        SENDS_IN_FLIGHT.inc()
+        try:
+            result = await self._send_email(email_job, user_access_token, user_refresh_token, token_expiry)
+        finally:
+            SENDS_IN_FLIGHT.dec()
+        result.latency_ms = round((time.perf_counter() - started) * 1000, 3)
+        SENDS_TOTAL.labels(outcome="success" if result.success else "failure").inc()
+        send_history.record(email_job, result)
+        return result
+
+    async def _send_email(self, email_job: EmailJob, user_access_token: str, user_refresh_token: str, token_expiry: Optional[datetime] = None) -> EmailSendResult:
         """Send an email using Gmail API."""
         try:
             # Get valid credentials
-            credentials = await self._get_valid_credentials(user_access_token, user_refresh_token)
-            
-            # Build Gmail service
-            service = build('gmail', 'v1', credentials=credentials)
+            with SEND_PHASE_DURATION.labels(phase="credentials").time():
+                credentials = await self._get_valid_credentials(user_access_token, user_refresh_token, token_expiry)
+            if credentials.token != user_access_token:
+                # Persist a fallback refresh so the next send can reuse it
+                await db.update_user_tokens(
+                    email_job.user_id,
+                    credentials.token,
+                    credentials.refresh_token,
+                    credentials.expiry
+                )
             
             # Get user's email address
-            user_info = await google_oauth2.get_user_info(credentials.token)
+            with SEND_PHASE_DURATION.labels(phase="userinfo").time():
+                user_info = await google_oauth2.get_user_info(credentials.token)
             sender_email = user_info['email']
             
+            # Fetch attachments; a missing one fails the send rather than going out without it
+            with SEND_PHASE_DURATION.labels(phase="attachments").time():
+                attachment_paths = [
+                    await attachment_storage.local_path(reference, email_job.user_id)
+                    for reference in email_job.attachments
+                ]
+            
             # Create message
-            message = self._create_message(
-                sender=sender_email,
-                to=email_job.recipient,
-                subject=email_job.subject,
-                body=email_job.body,
-                attachments=email_job.attachments
-            )
+            with SEND_PHASE_DURATION.labels(phase="mime_build").time():
+                try:
+                    message = self._create_message(
+                        sender=sender_email,
+                        to=email_job.recipient,
+                        subject=email_job.subject,
+                        body=email_job.get_body(),
+                        attachments=attachment_paths
+                    )
+                except AttachmentNotFoundError:
+                    raise
+                except (ValueError, TypeError, UnicodeError) as e:
+                    raise InvalidMessageError(f"Cannot build message: {e}") from e
             
             # Send email
-            sent_message = service.users().messages().send(userId='me', body=message).execute()
+            with SEND_PHASE_DURATION.labels(phase="gmail_send").time():
+                sent_message = await self._gmail_request("POST", "messages/send", credentials.token, message)
             
             sent_time = datetime.utcnow()
-            next_send = sent_time + timedelta(days=email_job.every_n_days)
             
             return EmailSendResult(
                 job_id=email_job.id,
@@ -116,35 +235,40 @@ class EmailService:
                 success=True
             )
             
-        except HttpError as error:
-            logger.error(f"Gmail API error: {error}")
+        except httpx.HTTPStatusError as error:
+            logger.error("Gmail API error for job %s: %s", email_job.id, error, extra=hot_path(job_id=email_job.id))
+            error_class, retryable = classify_send_error(error)
             return EmailSendResult(
                 job_id=email_job.id,
                 recipient=email_job.recipient,
                 subject=email_job.subject,
                 sent_at=datetime.utcnow(),
                 success=False,
-                error_message=str(error)
+                error_message=str(error),
+                error_class=error_class,
+                retryable=retryable
             )
         except Exception as e:
-            logger.error(f"Error sending email: {e}")
+            logger.error("Error sending email for job %s: %s", email_job.id, e, extra=hot_path(job_id=email_job.id))
+            error_class, retryable = classify_send_error(e)
             return EmailSendResult(
                 job_id=email_job.id,
                 recipient=email_job.recipient,
                 subject=email_job.subject,
                 sent_at=datetime.utcnow(),
                 success=False,
-                error_message=str(e)
+                error_message=str(e),
+                error_class=error_class,
+                retryable=retryable
             )
 
-    async def test_email_connection(self, access_token: str, refresh_token: str) -> bool:
+    async def test_email_connection(self, access_token: str, refresh_token: str, token_expiry: Optional[datetime] = None) -> bool:
         """Test if the user's Gmail connection is working."""
         try:
-            credentials = await self._get_valid_credentials(access_token, refresh_token)
-            service = build('gmail', 'v1', credentials=credentials)
+            credentials = await self._get_valid_credentials(access_token, refresh_token, token_expiry)
             
             # Try to get user profile to test connection
-            profile = service.users().getProfile(userId='me').execute()
+            profile = await self._gmail_request("GET", "profile", credentials.token)
             return True
         except Exception as e:
             logger.error(f"Email connection test failed: {e}")
@@ -0,0 +1,61 @@
+from typing import Optional
+import importlib.util
+import httpx
+import logging
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class GoogleHTTPClient:
+    """One pooled async HTTP client for every call to Google.
+
+    Token exchange and refresh, userinfo and Gmail all share its keep-alive
+    connections (multiplexed over HTTP/2 when the h2 package is installed), so
+    a send normally pays no DNS, TCP or TLS setup. Opened at startup and
+    closed at shutdown; scripts that never start it get one on first use.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client."""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = settings.google_http2_enabled and importlib.util.find_spec("h2") is not None
+        if settings.google_http2_enabled and not http2:
+            logger.warning("GOOGLE_HTTP2_ENABLED is set but the h2 package is not installed; using HTTP/1.1")
+        return httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(
+                settings.google_http_timeout_seconds,
+                connect=settings.google_http_connect_timeout_seconds
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.google_http_max_connections,
+                max_keepalive_connections=settings.google_http_max_keepalive_connections,
+                keepalive_expiry=settings.google_http_keepalive_expiry_seconds
+            )
+        )
+
+    async def start(self):
+        """Open the shared client."""
+        if self._client is None:
+            self._client = self._create_client()
+            logger.info("Google HTTP client started")
+
+    async def stop(self):
+        """Close the shared client and its connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Google HTTP client stopped")
+
+
+# Create Google HTTP client instance
+google_http = GoogleHTTPClient()
@@ -0,0 +1,142 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime
+from typing import Optional
+import asyncio
+import json
+import math
+import logging
+import time
+from config import settings
+from database import db
+from scheduler import email_scheduler
+from membership import membership
+from token_refresher import token_refresher
+from job_archiver import job_archiver
+
+logger = logging.getLogger(__name__)
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class HealthMonitor:
+    """Keep a status snapshot refreshed in the background for health probes.
+
+    Probes only read the last snapshot, so they answer in microseconds and never
+    wait on the database, however slow it is.
+    """
+
+    def __init__(self):
+        self.scheduler = AsyncIOScheduler()
+        self.is_running = False
+        self.snapshot: dict = {"status": "starting"}
+        self.snapshot_body: bytes = json.dumps(self.snapshot).encode("utf-8")
+        self.database_ok = False
+        # Monotonic time of the last refresh, None until the first one completes
+        self.refreshed_at: Optional[float] = None
+
+    async def start(self):
+        """Take a first snapshot and start refreshing it periodically."""
+        if not self.is_running:
+            await self.refresh()
+            self.scheduler.start()
+            self.is_running = True
+            self.scheduler.add_job(
+                self.refresh,
+                IntervalTrigger(seconds=settings.health_refresh_seconds),
+                id='health_monitor',
+                replace_existing=True
+            )
+            logger.info("Health monitor started")
+
+    async def stop(self):
+        """Stop refreshing the snapshot."""
+        if self.is_running:
+            self.scheduler.shutdown()
+            self.is_running = False
+            logger.info("Health monitor stopped")
+
+    @property
+    def is_ready(self) -> bool:
+        """Ready when the database was reachable at the last, recent enough, refresh."""
+        if self.refreshed_at is None or not self.database_ok:
+            return False
+        return time.monotonic() - self.refreshed_at < settings.health_refresh_seconds * 3
+
+    async def refresh(self):
+        """Probe each component and replace the snapshot."""
+        now = datetime.utcnow()
+
+        database = {"status": "not_connected", "latency_ms": None}
+        if db.is_connected:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(db.ping(), timeout=settings.health_db_timeout_seconds)
+                database["status"] = "connected"
+                database["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            except asyncio.TimeoutError:
+                database["status"] = "timeout"
+            except Exception as e:
+                database["status"] = f"error: {e}"
+
+        # A scheduler that has never ticked is lagging since it started
+        last_tick = email_scheduler.last_successful_tick or email_scheduler.started_at
+        scheduler_lag = (now - last_tick).total_seconds() if last_tick else None
+        scheduler_ok = (
+            email_scheduler.is_running
+            and scheduler_lag is not None
+            and scheduler_lag <= settings.health_max_scheduler_lag_seconds
+        )
+
+        pools = db.pool_stats()
+        if pools:
+            database["pools"] = pools
+
+        self.database_ok = database["status"] == "connected"
+        scheduler = {
+            "status": "ok" if scheduler_ok else "lagging",
+            "running": email_scheduler.is_running,
+            "last_successful_tick": _isoformat(email_scheduler.last_successful_tick),
+            "lag_seconds": round(scheduler_lag, 3) if scheduler_lag is not None else None,
+            "backlog": email_scheduler.last_backlog,
+            # Ticks run once a minute, each sending at most the per-tick cap
+            "drain_estimate_minutes": (
+                math.ceil(email_scheduler.last_backlog / settings.scheduler_max_jobs_per_tick)
+                if settings.scheduler_max_jobs_per_tick else None
+            )
+        }
+        if membership.enabled:
+            owned = membership.owned_partitions()
+            scheduler["partitioning"] = {
+                "worker_id": membership.worker_id,
+                "live_workers": len(membership.live_workers),
+                "owned_partitions": len(owned),
+                "last_heartbeat": _isoformat(membership.last_heartbeat)
+            }
+        self.snapshot = {
+            "status": "healthy" if self.database_ok and scheduler_ok else "degraded",
+            "timestamp": now.isoformat(),
+            "database": database,
+            "database_backend": settings.database_backend,
+            "scheduler": scheduler,
+            "token_refresher": {
+                "running": token_refresher.is_running,
+                "last_run": _isoformat(token_refresher.last_run),
+                "last_refreshed": token_refresher.last_refreshed,
+                "last_failed": token_refresher.last_failed
+            },
+            "job_archiver": {
+                "running": job_archiver.is_running,
+                "last_run": _isoformat(job_archiver.last_run),
+                "last_archived": job_archiver.last_archived,
+                "last_reclaimed_bytes": job_archiver.last_reclaimed
+            }
+        }
+        self.snapshot_body = json.dumps(self.snapshot).encode("utf-8")
+        self.refreshed_at = time.monotonic()
+
+
+# Create health monitor instance
+health_monitor = HealthMonitor()
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException, Response, status
+import asyncio
+import hashlib
+import json
+import logging
+from config import settings
+from database import db
+from models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+# Response headers stored with the response and replayed with it
+REPLAYED_HEADERS = ("location",)
+
+# How often a request waits on a key held by another replica checks on it
+POLL_INTERVAL_SECONDS = 0.2
+
+
+def request_fingerprint(method: str, path: str, body: Optional[dict] = None) -> str:
+    """Fingerprint of a request, to tell a retry from a different request reusing a key."""
+    payload = json.dumps(body, sort_keys=True, default=str) if body is not None else ""
+    return hashlib.sha256(f"{method} {path}\n{payload}".encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Run a request at most once per Idempotency-Key and replay its response.
+
+    Keys are scoped to the user and claimed in the idempotency_keys collection,
+    which expires them after IDEMPOTENCY_KEY_TTL_HOURS. Completed responses are
+    also kept in a small in-process LRU cache, so most retries never reach the
+    database. A request arriving while the first one with its key is still
+    running waits for it (up to IDEMPOTENCY_WAIT_SECONDS) and gets its
+    response. Only 2xx responses are stored; on an error the key is released
+    and the request can be retried.
+    """
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, IdempotencyRecord]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: Optional[str],
+        user_id: str,
+        fingerprint: str,
+        handler: Callable[[], Awaitable[Response]]
+    ) -> Response:
+        """Run ``handler`` unless a request with this key already ran, then replay its response."""
+        if key is None:
+            return await handler()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"
+            )
+        scoped_key = f"{user_id}:{key}"
+
+        # Wait out a request with the same key in this process
+        while True:
+            cached = self._cached(scoped_key)
+            if cached:
+                return self._replay(cached, fingerprint)
+            pending = self._inflight.get(scoped_key)
+            if pending is None:
+                break
+            await asyncio.shield(pending)
+
+        self._inflight[scoped_key] = asyncio.get_running_loop().create_future()
+        try:
+            record = IdempotencyRecord(key=scoped_key, user_id=user_id, fingerprint=fingerprint)
+            existing = await self._claim(record)
+            if existing:
+                return self._replay(existing, fingerprint)
+
+            try:
+                response = await handler()
+            except BaseException:
+                await self._release(scoped_key)
+                raise
+
+            if 200 <= response.status_code < 300:
+                record.status_code = response.status_code
+                record.response_body = response.body.decode("utf-8")
+                record.headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+                record.completed_at = datetime.utcnow()
+                try:
+                    await db.complete_idempotency_key(scoped_key, record.status_code, record.response_body, record.headers)
+                except Exception as e:
+                    # The handler already ran, so keep the claim rather than let the request run twice;
+                    # retries reaching this process still replay from the cache
+                    logger.error(f"Failed to store response for idempotency key {scoped_key}: {e}")
+                self._remember(record)
+            else:
+                await self._release(scoped_key)
+            return response
+        finally:
+            self._inflight.pop(scoped_key).set_result(None)
+
+    async def _claim(self, record: IdempotencyRecord) -> Optional[IdempotencyRecord]:
+        """Claim the key, or return its completed record, waiting if another replica holds it."""
+        deadline = asyncio.get_running_loop().time() + settings.idempotency_wait_seconds
+        while True:
+            existing = await db.claim_idempotency_key(record)
+            if existing is None:
+                return None
+            while existing is not None and existing.completed_at is None:
+                if asyncio.get_running_loop().time() >= deadline:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT,
+                        detail="A request with this Idempotency-Key is still in progress"
+                    )
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+                existing = await db.get_idempotency_key(record.key)
+            if existing is not None:
+                self._remember(existing)
+                return existing
+            # The other request failed and released the key; claim it ourselves
+
+    async def _release(self, scoped_key: str):
+        try:
+            await db.release_idempotency_key(scoped_key)
+        except Exception as e:
+            logger.error(f"Failed to release idempotency key {scoped_key}: {e}")
+
+    def _cached(self, scoped_key: str) -> Optional[IdempotencyRecord]:
+        record = self._cache.get(scoped_key)
+        if record is None:
+            return None
+        if record.created_at < datetime.utcnow() - timedelta(hours=settings.idempotency_key_ttl_hours):
+            del self._cache[scoped_key]
+            return None
+        self._cache.move_to_end(scoped_key)
+        return record
+
+    def _remember(self, record: IdempotencyRecord):
+        self._cache[record.key] = record
+        self._cache.move_to_end(record.key)
+        while len(self._cache) > settings.idempotency_cache_size:
+            self._cache.popitem(last=False)
+
+    def _replay(self, record: IdempotencyRecord, fingerprint: str) -> Response:
+        if record.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different request"
+            )
+        return Response(
+            content=record.response_body,
+            status_code=record.status_code,
+            media_type="application/json",
+            headers={**record.headers, "Idempotent-Replayed": "true"}
+        )
+
+
+# Create idempotency store instance
+idempotency_store = IdempotencyStore()
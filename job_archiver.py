@@ -0,0 +1,101 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import logging
+from config import settings
+from database import db, use_scheduler_pool
+from membership import membership
+from metrics import JOBS_ARCHIVED
+from scheduler import email_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class JobArchiver:
+    """Move long-deleted jobs out of email_jobs in the background.
+
+    Deleting a job only marks it deleted, so without this every deleted job
+    stays in the indexes that due queries and listings scan. Jobs deleted more
+    than JOB_ARCHIVE_RETENTION_DAYS ago are moved to email_jobs_archive in
+    batches of JOB_ARCHIVE_BATCH_SIZE. The archiver pauses between batches and
+    while a scheduler tick is running, and with partitioning each replica only
+    archives its own partitions.
+    """
+
+    def __init__(self):
+        self.scheduler = AsyncIOScheduler()
+        self.is_running = False
+        self._lock = asyncio.Lock()
+        self.last_run: Optional[datetime] = None
+        self.last_archived = 0
+        self.last_reclaimed: Dict[str, int] = {}
+
+    async def start(self):
+        """Start the background archiver."""
+        if not self.is_running and settings.job_archive_enabled:
+            self.scheduler.start()
+            self.is_running = True
+            logger.info("Job archiver started")
+
+            self.scheduler.add_job(
+                self.archive_deleted_jobs,
+                IntervalTrigger(minutes=settings.job_archive_interval_minutes),
+                id='job_archiver',
+                replace_existing=True
+            )
+
+    async def stop(self):
+        """Stop the background archiver."""
+        if self.is_running:
+            self.scheduler.shutdown()
+            self.is_running = False
+            logger.info("Job archiver stopped")
+
+    async def archive_deleted_jobs(self):
+        """Archive every job past the retention period, batch by batch."""
+        use_scheduler_pool()
+        if not db.is_connected or self._lock.locked():
+            return
+
+        async with self._lock:
+            # A run started by the timer stops between batches once the archiver is stopped
+            scheduled = self.is_running
+            archived = 0
+            try:
+                before = await db.get_job_storage_stats()
+                deleted_before = datetime.utcnow() - timedelta(days=settings.job_archive_retention_days)
+                while True:
+                    while email_scheduler.tick_in_progress:
+                        await asyncio.sleep(settings.job_archive_batch_pause_seconds)
+                    moved = await db.archive_deleted_jobs(
+                        deleted_before,
+                        settings.job_archive_batch_size,
+                        membership.owned_partitions()
+                    )
+                    archived += moved
+                    JOBS_ARCHIVED.inc(moved)
+                    if moved < settings.job_archive_batch_size or (scheduled and not self.is_running):
+                        break
+                    await asyncio.sleep(settings.job_archive_batch_pause_seconds)
+
+                after = await db.get_job_storage_stats()
+                self.last_reclaimed = {
+                    name: before[name] - after[name] for name in ("collection_bytes", "index_bytes") if name in before
+                }
+                if archived:
+                    logger.info(
+                        f"Archived {archived} deleted jobs, reclaiming "
+                        f"{self.last_reclaimed.get('collection_bytes', 'unknown')} collection bytes and "
+                        f"{self.last_reclaimed.get('index_bytes', 'unknown')} index bytes"
+                    )
+            except Exception as e:
+                logger.error(f"Error archiving deleted jobs: {e}")
+            finally:
+                self.last_run = datetime.utcnow()
+                self.last_archived = archived
+
+
+# Create job archiver instance
+job_archiver = JobArchiver()
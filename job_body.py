@@ -0,0 +1,28 @@
+from typing import Optional
+import zlib
+from config import settings
+
+# Stored job fields holding the message body
+BODY_FIELDS = ("body", "body_compressed")
+
+
+def compress_body(body: str) -> Optional[bytes]:
+    """zlib-compress a body over the size threshold; None if it is stored as text."""
+    encoded = body.encode("utf-8")
+    threshold = settings.job_body_compression_threshold_bytes
+    if not threshold or len(encoded) < threshold:
+        return None
+    return zlib.compress(encoded, settings.job_body_compression_level)
+
+
+def decompress_body(body_compressed: bytes) -> str:
+    """Inverse of compress_body."""
+    return zlib.decompress(body_compressed).decode("utf-8")
+
+
+def body_storage_fields(body: str) -> dict:
+    """Stored fields for a body: plain text, or an empty body plus the compressed bytes."""
+    body_compressed = compress_body(body)
+    if body_compressed is None:
+        return {"body": body, "body_compressed": None}
+    return {"body": "", "body_compressed": body_compressed}
@@ -0,0 +1,158 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+from config import settings
+from metrics import LOG_RECORDS_DROPPED
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# Extras left out of JSON lines: our rate-limit marker and uvicorn's ANSI-colored copy of the message
+_OMITTED_EXTRAS = {"hot_path", "color_message"}
+
+# Applied to every formatted line: credentials in URLs, bearer and Google tokens, key=value secrets
+_REDACTIONS = [
+    (re.compile(r"(\w+(?:\+\w+)?://)[^/\s:@]+:[^/\s@]+@"), r"\1***:***@"),
+    (re.compile(r"(?i)(bearer\s+)[\w.~+/=-]+"), r"\1***"),
+    (re.compile(r"\bya29\.[\w.-]+"), "***"),
+    (re.compile(r"\b1//[\w.-]+"), "***"),
+    (
+        re.compile(r"(?i)([\"']?\b(?:access_token|refresh_token|id_token|client_secret|password|secret|authorization)[\"']?\s*[:=]\s*[\"']?)[^\s\"',&}]+"),
+        r"\1***"
+    ),
+]
+
+_listener: Optional[QueueListener] = None
+
+
+def hot_path(**fields) -> dict:
+    """``extra`` for a log call made once per job, rate-limited by HotPathRateLimiter."""
+    return {"hot_path": True, **fields}
+
+
+def redact(text: str) -> str:
+    """Mask secrets in a log line."""
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class HotPathRateLimiter(logging.Filter):
+    """Let each hot-path call site log at most ``per_second`` records a second.
+
+    The next record let through from a call site carries the number dropped
+    before it as ``suppressed``. Other records always pass.
+    """
+
+    def __init__(self, per_second: int):
+        super().__init__()
+        self.per_second = per_second
+        # (pathname, lineno) -> [second, logged, suppressed]
+        self._windows: Dict[tuple, List[int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.per_second or not getattr(record, "hot_path", False):
+            return True
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        window = self._windows.get(key)
+        if window is None or window[0] != second:
+            suppressed = window[2] if window else 0
+            window = self._windows[key] = [second, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+        if window[1] >= self.per_second:
+            window[2] += 1
+            LOG_RECORDS_DROPPED.labels(reason="rate_limited").inc()
+            return False
+        window[1] += 1
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hand records to the listener thread without formatting them or ever blocking."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Messages are formatted in the listener thread, off the event loop
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the ``extra`` fields of the call."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and name not in _OMITTED_EXTRAS:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, default=str))
+
+
+class RedactingFormatter(logging.Formatter):
+    """Plain-text lines, with secrets masked."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            line += f" ({suppressed} similar suppressed)"
+        return redact(line)
+
+
+def setup_logging():
+    """Route all logging through a bounded queue to a stdout writer thread.
+
+    Logging calls only enqueue the record; formatting (JSON or text, per
+    LOG_FORMAT), redaction and the write happen in a QueueListener thread.
+    When LOG_QUEUE_SIZE records are already waiting, new ones are dropped
+    rather than blocking the event loop. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(RedactingFormatter("%(levelname)s:%(name)s:%(message)s"))
+
+    log_queue = queue.Queue(maxsize=settings.log_queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(HotPathRateLimiter(settings.log_hot_path_per_second))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.log_level)
+    # Send uvicorn's own loggers through the same pipeline
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    # httpx logs every request to Google at INFO, several per send
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+    # Stopping the listener writes out whatever is still queued
+    atexit.register(_listener.stop)
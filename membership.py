@@ -0,0 +1,105 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+import os
+import socket
+import uuid
+from config import settings
+from database import db, use_scheduler_pool
+from partitioning import SCHEDULER_PARTITIONS, assign_partitions
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerMembership:
+    """Heartbeat this scheduler replica and work out which partitions it owns.
+
+    Every replica heartbeats into the database and recomputes the assignment
+    from the set of live workers, so partitions rebalance on their own as
+    replicas start, stop or die. Partitions taken over from another worker
+    only become active after one heartbeat interval, by which time the previous
+    owner has seen the new membership and dropped them.
+    """
+
+    def __init__(self):
+        self.scheduler = AsyncIOScheduler()
+        self.is_running = False
+        self.worker_id = settings.scheduler_worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.live_workers: List[str] = []
+        # Partition -> when this worker was first assigned it
+        self._assigned: Dict[int, datetime] = {}
+        self.last_heartbeat: Optional[datetime] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.scheduler_partitioning_enabled
+
+    def owned_partitions(self) -> Optional[List[int]]:
+        """Partitions this worker should scan, or None to scan every job."""
+        if not self.enabled:
+            return None
+        active_before = datetime.utcnow() - timedelta(seconds=settings.scheduler_heartbeat_seconds)
+        return sorted(partition for partition, since in self._assigned.items() if since <= active_before)
+
+    async def start(self):
+        """Register this worker and start heartbeating."""
+        if self.enabled and not self.is_running:
+            await self.heartbeat()
+            self.scheduler.start()
+            self.is_running = True
+            self.scheduler.add_job(
+                self.heartbeat,
+                IntervalTrigger(seconds=settings.scheduler_heartbeat_seconds),
+                id='worker_heartbeat',
+                replace_existing=True
+            )
+            logger.info(f"Scheduler worker {self.worker_id} registered")
+
+    async def stop(self):
+        """Stop heartbeating and deregister so the others take over at once."""
+        if self.is_running:
+            self.scheduler.shutdown()
+            self.is_running = False
+            self._assigned = {}
+            try:
+                await db.remove_worker(self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to deregister scheduler worker {self.worker_id}: {e}")
+            logger.info(f"Scheduler worker {self.worker_id} deregistered")
+
+    async def heartbeat(self):
+        """Record a heartbeat and recompute owned partitions from the live workers."""
+        use_scheduler_pool()
+        if not db.is_connected:
+            return
+        try:
+            now = datetime.utcnow()
+            await db.heartbeat_worker(self.worker_id, now)
+            live_since = now - timedelta(seconds=settings.scheduler_worker_timeout_seconds)
+            self.live_workers = sorted(set(await db.get_live_workers(live_since)) | {self.worker_id})
+            self.last_heartbeat = now
+        except Exception as e:
+            # Keep the last assignment; the others drop us once our heartbeat expires
+            logger.error(f"Scheduler worker heartbeat failed: {e}")
+            return
+
+        owned = assign_partitions(self.live_workers)[self.worker_id]
+        gained = owned - set(self._assigned)
+        lost = set(self._assigned) - owned
+        # The very first assignment is active straight away, nobody else can own it yet
+        since = now if self._assigned or len(self.live_workers) > 1 else datetime.min
+        for partition in gained:
+            self._assigned[partition] = since
+        for partition in lost:
+            del self._assigned[partition]
+        if gained or lost:
+            logger.info(
+                f"Scheduler worker {self.worker_id} owns {len(owned)}/{SCHEDULER_PARTITIONS} partitions "
+                f"across {len(self.live_workers)} worker(s) (+{len(gained)} -{len(lost)})"
+            )
+
+
+# Create worker membership instance
+membership = WorkerMembership()
@@ -0,0 +1,133 @@
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from functools import wraps
+import time
+
+# Buckets tuned for sub-millisecond Mongo calls up to multi-second Gmail sends
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+SCHEDULER_TICK_DURATION = Histogram(
+    "email_scheduler_tick_duration_seconds",
+    "Duration of one check_and_send_emails tick",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+SCHEDULER_BACKLOG = Gauge(
+    "email_scheduler_backlog_jobs",
+    "Number of due jobs found by the last scheduler tick"
+)
+SENDS_IN_FLIGHT = Gauge(
+    "email_sends_in_flight",
+    "Number of email sends currently in progress"
+)
+SEND_PHASE_DURATION = Histogram(
+    "email_send_phase_duration_seconds",
+    "Duration of each phase of EmailService.send_email",
+    ["phase"],
+    buckets=LATENCY_BUCKETS
+)
+SENDS_TOTAL = Counter(
+    "email_sends_total",
+    "Email send attempts by outcome",
+    ["outcome"]
+)
+DB_OPERATION_DURATION = Histogram(
+    "db_operation_duration_seconds",
+    "Duration of Database operations",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out_connections",
+    "Connections currently checked out of each MongoDB client pool",
+    ["pool"]
+)
+MONGO_POOL_WAITERS = Gauge(
+    "mongo_pool_waiters",
+    "Operations currently waiting for a connection from each MongoDB client pool",
+    ["pool"]
+)
+MONGO_POOL_WAIT_DURATION = Histogram(
+    "mongo_pool_wait_duration_seconds",
+    "Time spent waiting to check a connection out of each MongoDB client pool",
+    ["pool"],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "mongo_pool_checkout_failures_total",
+    "Failed connection checkouts by pool and reason (e.g. timeout)",
+    ["pool", "reason"]
+)
+DISPATCH_QUEUE_DEPTH = Gauge(
+    "email_dispatch_queue_depth",
+    "Sends waiting for a dispatch worker, by lane",
+    ["lane"]
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records not written, by reason (rate_limited, queue_full)",
+    ["reason"]
+)
+JOBS_ARCHIVED = Counter(
+    "email_jobs_archived_total",
+    "Deleted jobs moved to the archive"
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "API request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+
+def track_db_operation(func):
+    """Record the duration of an async Database method under its own name."""
+    histogram = DB_OPERATION_DURATION.labels(operation=func.__name__)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class PrometheusMiddleware:
+    """ASGI middleware recording request latency per route template.
+
+    Labels use the matched route path (``/jobs/{job_id}``) rather than the raw
+    URL so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> tuple:
+    """Render all metrics in the Prometheus text format as ``(body, content_type)``."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,12 +1,14 @@
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
-from datetime import datetime
+from pydantic import BaseModel, EmailStr, Field, field_serializer
+from typing import Optional, List, Dict
+from datetime import date, datetime
 from enum import Enum
+from job_body import decompress_body
 
 
 class EmailJobStatus(str, Enum):
     ACTIVE = "active"
     PAUSED = "paused"
+    FAILED = "failed"
     DELETED = "deleted"
 
 
@@ -18,24 +20,59 @@ class User(BaseModel):
     access_token: str
     refresh_token: Optional[str] = None 
     token_expiry: datetime
+    # Bumped on every write to the user's jobs; backs the GET /jobs ETag
+    jobs_version: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+# "HH:MM" in UTC; the empty string clears it on update
+PREFERRED_SEND_TIME_PATTERN = r"^(([01]\d|2[0-3]):[0-5]\d)?$"
+
+
 class EmailJob(BaseModel):
     id: Optional[str] = None
     user_id: str
     recipient: EmailStr
     subject: str
-    body: str
+    body: Optional[str] = Field(None, description="Null in listings requested without bodies")
+    # Large bodies are stored zlib-compressed and only decompressed by get_body
+    body_compressed: Optional[bytes] = Field(None, exclude=True, repr=False)
     attachments: List[str] = []
     every_n_days: int = Field(gt=0, description="Send email every N days")
+    preferred_send_time: Optional[str] = Field(None, pattern=PREFERRED_SEND_TIME_PATTERN, description="Fixed send time of day, HH:MM UTC")
+    priority: int = Field(0, ge=0, le=9, description="Higher priorities are sent first when jobs queue up")
     last_sent: Optional[datetime] = None
     next_send: Optional[datetime] = None
     status: EmailJobStatus = EmailJobStatus.ACTIVE
+    attempts: int = 0
+    last_error: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+    @classmethod
+    def from_trusted(cls, data: dict) -> "EmailJob":
+        """Build a job from a record we stored ourselves, without validation.
+
+        Jobs are validated at the API boundary before they are written, so the
+        read paths skip re-validating them (EmailStr checks included), which is
+        most of the per-job decode cost in large scheduler ticks.
+        """
+        fields = {name: data[name] for name in cls.model_fields if name in data}
+        fields["status"] = EmailJobStatus(fields.get("status", EmailJobStatus.ACTIVE))
+        return cls.model_construct(**fields)
+
+    def get_body(self) -> Optional[str]:
+        """The message body, decompressing a compressed one on first use."""
+        if self.body_compressed is not None:
+            self.body = decompress_body(self.body_compressed)
+            self.body_compressed = None
+        return self.body
+
+    @field_serializer("body")
+    def _serialize_body(self, body: Optional[str]) -> Optional[str]:
+        return self.get_body()
+
 
 class EmailJobCreate(BaseModel):
     recipient: EmailStr
@@ -43,6 +80,8 @@ class EmailJobCreate(BaseModel):
     body: str
     attachments: List[str] = []
     every_n_days: int = Field(gt=0, description="Send email every N days")
+    preferred_send_time: Optional[str] = Field(None, pattern=PREFERRED_SEND_TIME_PATTERN, description="Fixed send time of day, HH:MM UTC")
+    priority: int = Field(0, ge=0, le=9, description="Higher priorities are sent first when jobs queue up")
 
 
 class EmailJobUpdate(BaseModel):
@@ -51,6 +90,8 @@ class EmailJobUpdate(BaseModel):
     body: Optional[str] = None
     attachments: Optional[List[str]] = None
     every_n_days: Optional[int] = Field(None, gt=0)
+    preferred_send_time: Optional[str] = Field(None, pattern=PREFERRED_SEND_TIME_PATTERN, description="Fixed send time of day, HH:MM UTC; empty to clear")
+    priority: Optional[int] = Field(None, ge=0, le=9)
     status: Optional[EmailJobStatus] = None
 
 
@@ -74,4 +115,93 @@ class EmailSendResult(BaseModel):
     subject: str
     sent_at: datetime
     success: bool
-    error_message: Optional[str] = None 
\ No newline at end of file
+    error_message: Optional[str] = None
+    error_class: Optional[str] = None
+    retryable: bool = True
+    latency_ms: Optional[float] = None
+
+
+class SendHistoryEntry(BaseModel):
+    id: Optional[str] = None
+    job_id: str
+    user_id: str
+    recipient: str
+    sent_at: datetime
+    success: bool
+    latency_ms: Optional[float] = None
+    error_class: Optional[str] = None
+    error_message: Optional[str] = None
+
+
+class SendHistoryPage(BaseModel):
+    items: List[SendHistoryEntry]
+    next_cursor: Optional[str] = None 
+
+
+class DailySendStats(BaseModel):
+    date: date
+    sent: int = 0
+    failed: int = 0
+
+
+class SendStats(BaseModel):
+    """A user's send attempts per UTC day, and their jobs still waiting to send."""
+    days: List[DailySendStats]
+    sent: int
+    failed: int
+    pending: int
+
+
+class SendRequestStatus(str, Enum):
+    QUEUED = "queued"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class SendRequest(BaseModel):
+    """An interactive send-now request, processed asynchronously."""
+    id: Optional[str] = None
+    job_id: str
+    user_id: str
+    status: SendRequestStatus = SendRequestStatus.QUEUED
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    error_message: Optional[str] = None
+
+
+class IdempotencyRecord(BaseModel):
+    """A claimed Idempotency-Key and, once the request finished, its response."""
+    key: str
+    user_id: str
+    fingerprint: str
+    status_code: Optional[int] = None
+    response_body: Optional[str] = None
+    headers: Dict[str, str] = Field(default_factory=dict)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+
+
+class ProfileTarget(str, Enum):
+    SCHEDULER = "scheduler"
+    ROUTE = "route"
+
+
+class ProfileRequest(BaseModel):
+    target: ProfileTarget
+    route: Optional[str] = Field(None, description="Route template to profile, e.g. /jobs/{job_id}")
+    count: int = Field(1, gt=0, le=100, description="Number of ticks or requests to profile")
+
+
+class ProfileSession(BaseModel):
+    id: str
+    target: ProfileTarget
+    route: Optional[str] = None
+    requested: int
+    completed: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+    pstats_path: Optional[str] = None
+    summary: Optional[str] = None
@@ -0,0 +1,41 @@
+from bisect import bisect
+from typing import Dict, List, Set
+import hashlib
+import zlib
+
+# Fixed number of partitions jobs are stored under. It is baked into every
+# stored job, so changing it would mean re-partitioning every job.
+SCHEDULER_PARTITIONS = 256
+
+# Points per worker on the hash ring; more points spread partitions more evenly
+RING_POINTS_PER_WORKER = 256
+
+
+def partition_for_user(user_id: str) -> int:
+    """Partition a user's jobs are stored under; stable across processes."""
+    return zlib.crc32(user_id.encode("utf-8")) % SCHEDULER_PARTITIONS
+
+
+def _ring_hash(key: str) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def assign_partitions(worker_ids: List[str]) -> Dict[str, Set[int]]:
+    """Assign every partition to a worker by consistent hashing.
+
+    When a worker joins or leaves, only the partitions next to its points on
+    the ring move, so the other workers keep most of their slice.
+    """
+    if not worker_ids:
+        return {}
+    ring = sorted(
+        (_ring_hash(f"{worker_id}#{point}"), worker_id)
+        for worker_id in worker_ids
+        for point in range(RING_POINTS_PER_WORKER)
+    )
+    positions = [position for position, _ in ring]
+    assignment = {worker_id: set() for worker_id in worker_ids}
+    for partition in range(SCHEDULER_PARTITIONS):
+        index = bisect(positions, _ring_hash(f"partition-{partition}")) % len(ring)
+        assignment[ring[index][1]].add(partition)
+    return assignment
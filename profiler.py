@@ -0,0 +1,148 @@
+from starlette.routing import Match
+from datetime import datetime
+from typing import Dict, Optional
+import cProfile
+import io
+import logging
+import os
+import pstats
+import uuid
+from config import settings
+from models import ProfileSession, ProfileTarget
+
+logger = logging.getLogger(__name__)
+
+
+class _Capture:
+    """An armed profiling session accumulating stats over several runs."""
+
+    def __init__(self, session: ProfileSession):
+        self.session = session
+        self.profile = cProfile.Profile()
+
+
+class Profiler:
+    """Profile the next N scheduler ticks or requests to a route on demand.
+
+    Nothing is armed by default; the hot paths only check ``self.active``.
+    cProfile follows the thread, not the task, so coroutines interleaved with
+    the profiled one on the event loop show up in the stats as well.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._captures: Dict[str, _Capture] = {}
+        self._sessions: Dict[str, ProfileSession] = {}
+        # cProfile only supports one enabled profiler per thread
+        self._busy = False
+
+    def arm(self, target: ProfileTarget, count: int, route: Optional[str] = None) -> ProfileSession:
+        """Arm a profiling session for the next ``count`` runs of the target."""
+        key = self._key(target, route)
+        if key in self._captures:
+            raise ValueError(f"A profiling session for {key} is already armed")
+
+        session = ProfileSession(
+            id=uuid.uuid4().hex,
+            target=target,
+            route=route,
+            requested=count
+        )
+        self._captures[key] = _Capture(session)
+        self._sessions[session.id] = session
+        self.active = True
+        logger.info(f"Profiling armed for the next {count} run(s) of {key}")
+        return session
+
+    def get_session(self, session_id: str) -> Optional[ProfileSession]:
+        """Get a profiling session by id."""
+        return self._sessions.get(session_id)
+
+    def acquire(self, target: ProfileTarget, route: Optional[str] = None) -> Optional[_Capture]:
+        """Start profiling a run of the target if a session is armed for it."""
+        if self._busy:
+            return None
+        capture = self._captures.get(self._key(target, route))
+        if capture is None:
+            return None
+        self._busy = True
+        capture.profile.enable()
+        return capture
+
+    def release(self, capture: _Capture):
+        """Stop profiling a run and finish the session once it has enough runs."""
+        capture.profile.disable()
+        self._busy = False
+        session = capture.session
+        session.completed += 1
+        if session.completed >= session.requested:
+            self._finish(capture)
+
+    def armed_routes(self) -> set:
+        """Route templates with an armed session."""
+        return {
+            capture.session.route
+            for capture in self._captures.values()
+            if capture.session.target == ProfileTarget.ROUTE
+        }
+
+    def _finish(self, capture: _Capture):
+        session = capture.session
+        del self._captures[self._key(session.target, session.route)]
+        self.active = bool(self._captures)
+
+        os.makedirs(settings.profile_dir, exist_ok=True)
+        pstats_path = os.path.join(settings.profile_dir, f"{session.id}.pstats")
+        capture.profile.dump_stats(pstats_path)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(capture.profile, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(settings.profile_top_functions)
+
+        session.pstats_path = pstats_path
+        session.summary = summary.getvalue()
+        session.completed_at = datetime.utcnow()
+        logger.info(f"Profiling session {session.id} complete, stats written to {pstats_path}")
+
+    @staticmethod
+    def _key(target: ProfileTarget, route: Optional[str]) -> str:
+        return route if target == ProfileTarget.ROUTE else target.value
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests to routes with an armed session."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.active or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_path = self._match_route(scope)
+        capture = profiler.acquire(ProfileTarget.ROUTE, route_path) if route_path else None
+        if capture is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.release(capture)
+
+    @staticmethod
+    def _match_route(scope) -> Optional[str]:
+        armed = profiler.armed_routes()
+        if not armed:
+            return None
+        for route in scope["app"].router.routes:
+            if getattr(route, "path", None) in armed:
+                match, _ = route.matches(scope)
+                if match == Match.FULL:
+                    return route.path
+        return None
+
+
+# Create profiler instance
+profiler = Profiler()
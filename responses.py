@@ -0,0 +1,19 @@
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from typing import Any
+
+# Serializes models (and lists/dicts of them) straight from pydantic-core
+_any_adapter = TypeAdapter(Any)
+
+
+class ModelJSONResponse(JSONResponse):
+    """JSON response that serializes pydantic models in pydantic-core.
+
+    Returning it from a route skips FastAPI's response_model round trip (a
+    second validation of every model, jsonable_encoder, then the stdlib json
+    encoder), while the route's response_model still documents the schema.
+    Only return models that were validated or trusted on the way in.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return _any_adapter.dump_json(content)
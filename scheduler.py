@@ -1,26 +1,55 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime, timedelta
+import asyncio
 import logging
-from typing import List
-from database import db
+import random
+from typing import List, Optional
+from config import settings
+from database import db, use_scheduler_pool
+from dispatcher import send_dispatcher
 from email_service import EmailService
-from models import EmailJob, EmailSendResult
+from models import EmailJob, EmailSendResult, ProfileTarget, SendRequest, SendRequestStatus
+from membership import membership
+from metrics import SCHEDULER_TICK_DURATION, SCHEDULER_BACKLOG
+from profiler import profiler
+from logging_setup import hot_path
+from send_planner import send_planner
 
 logger = logging.getLogger(__name__)
 
 
+def compute_retry_delay(attempts: int) -> float:
+    """Exponential backoff in seconds for the given attempt count, with jitter.
+
+    The jitter keeps jobs that failed together (e.g. during a Gmail outage)
+    from all retrying in the same tick.
+    """
+    delay = min(
+        settings.send_retry_max_seconds,
+        settings.send_retry_base_seconds * (2 ** (attempts - 1))
+    )
+    return random.uniform(delay / 2, delay)
+
+
 class EmailScheduler:
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
         self.email_service = EmailService()
         self.is_running = False
+        self.started_at: Optional[datetime] = None
+        self.last_successful_tick: Optional[datetime] = None
+        self.last_backlog = 0
+        self.tick_in_progress = False
+        self._tick_idle = asyncio.Event()
+        self._tick_idle.set()
 
     async def start(self):
         """Start the scheduler."""
         if not self.is_running:
             self.scheduler.start()
             self.is_running = True
+            self.started_at = datetime.utcnow()
             logger.info("Email scheduler started")
             
             # Schedule the email checking job to run every minute
@@ -32,26 +61,74 @@ class EmailScheduler:
             )
 
     async def stop(self):
-        """Stop the scheduler."""
+        """Stop the scheduler, draining for up to SHUTDOWN_DRAIN_SECONDS.
+
+        No new tick starts, jobs not yet handed to a worker are handed back
+        (they stay due), and sends already in flight get to finish and record
+        their result, so nothing is sent twice after a restart.
+        """
         if self.is_running:
-            self.scheduler.shutdown()
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.shutdown_drain_seconds
+            self.scheduler.pause()
             self.is_running = False
-            logger.info("Email scheduler stopped")
+            drained = await send_dispatcher.drain(settings.shutdown_drain_seconds)
+            try:
+                await asyncio.wait_for(self._tick_idle.wait(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                drained = False
+            # Cancels a tick still running past the deadline
+            self.scheduler.shutdown()
+            if drained:
+                logger.info("Email scheduler stopped after draining in-flight sends")
+            else:
+                logger.warning("Email scheduler stopped before in-flight sends finished")
 
     async def check_and_send_emails(self):
         """Check for due emails and send them."""
+        use_scheduler_pool()
+        capture = profiler.acquire(ProfileTarget.SCHEDULER) if profiler.active else None
+        self.tick_in_progress = True
+        self._tick_idle.clear()
         try:
-            # Get all due email jobs
-            due_jobs = await db.get_due_email_jobs()
+            with SCHEDULER_TICK_DURATION.time():
+                await self._check_and_send_emails()
+        finally:
+            self.tick_in_progress = False
+            self._tick_idle.set()
+            if capture is not None:
+                profiler.release(capture)
+
+    async def _check_and_send_emails(self):
+        """Run one scheduler tick."""
+        try:
+            # Get due email jobs, only from our partitions when replicas split the work.
+            # A capped tick drains a backlog in priority then next_send order; the
+            # rest stay due and are picked up by the following ticks.
+            partitions = membership.owned_partitions()
+            limit = settings.scheduler_max_jobs_per_tick or None
+            due_jobs = await db.get_due_email_jobs(partitions, limit=limit)
+            if limit and len(due_jobs) >= limit:
+                backlog = await db.count_due_email_jobs(partitions)
+            else:
+                backlog = len(due_jobs)
+            self.last_backlog = backlog
+            SCHEDULER_BACKLOG.set(backlog)
             
             if not due_jobs:
                 logger.debug("No due emails to send")
+                self.last_successful_tick = datetime.utcnow()
                 return
             
-            logger.info(f"Found {len(due_jobs)} due emails to send")
+            if backlog > len(due_jobs):
+                logger.info(f"Draining backlog: sending {len(due_jobs)} of {backlog} due emails this tick")
+            else:
+                logger.info(f"Found {len(due_jobs)} due emails to send")
+            
+            # Interactive send-now requests are served ahead of these
+            await send_dispatcher.run_scheduled(due_jobs, self.send_single_email)
             
-            for job in due_jobs:
-                await self.send_single_email(job)
+            self.last_successful_tick = datetime.utcnow()
                 
         except Exception as e:
             logger.error(f"Error in check_and_send_emails: {e}")
@@ -66,37 +143,105 @@ class EmailScheduler:
             
             if not user:
                 logger.error(f"User not found for job {job.id}")
+                await self.record_failure(job, "User not found", retryable=False)
                 return
             
             # Send the email
             result = await self.email_service.send_email(
                 email_job=job,
                 user_access_token=user.access_token,
-                user_refresh_token=user.refresh_token
+                user_refresh_token=user.refresh_token,
+                token_expiry=user.token_expiry
             )
             
             if result.success:
                 # Update job with sent time and next send time
                 sent_time = result.sent_at
-                next_send = sent_time + timedelta(days=job.every_n_days)
+                next_send = send_planner.next_send_after(sent_time, job.every_n_days, job.preferred_send_time)
                 
                 await db.update_job_sent_time(job.id, sent_time, next_send)
-                logger.info(f"Email sent successfully for job {job.id} to {job.recipient}")
+                logger.info("Email sent successfully for job %s to %s", job.id, job.recipient, extra=hot_path(job_id=job.id))
             else:
-                logger.error(f"Failed to send email for job {job.id}: {result.error_message}")
+                logger.error(
+                    "Failed to send email for job %s: %s", job.id, result.error_message, extra=hot_path(job_id=job.id)
+                )
+                await self.record_failure(job, result.error_message, result.retryable)
                 
         except Exception as e:
-            logger.error(f"Error sending email for job {job.id}: {e}")
+            logger.error("Error sending email for job %s: %s", job.id, e, extra=hot_path(job_id=job.id))
+
+    async def send_requested(self, send_request: SendRequest, job: EmailJob):
+        """Process a send-now request, recording its progress on the request.
+
+        A failed send-now does not count towards the job's retry attempts.
+        """
+        try:
+            await db.update_send_request(send_request.id, {
+                "status": SendRequestStatus.SENDING,
+                "started_at": datetime.utcnow()
+            })
+            from auth import db as auth_db  # Import here to avoid circular import
+            user = await auth_db.get_user_by_id(job.user_id)
+            if not user:
+                raise ValueError("User not found")
+            
+            result = await self.email_service.send_email(
+                email_job=job,
+                user_access_token=user.access_token,
+                user_refresh_token=user.refresh_token,
+                token_expiry=user.token_expiry
+            )
+            
+            if result.success:
+                next_send = send_planner.next_send_after(result.sent_at, job.every_n_days, job.preferred_send_time)
+                await db.update_job_sent_time(job.id, result.sent_at, next_send)
+                await db.update_send_request(send_request.id, {
+                    "status": SendRequestStatus.SENT,
+                    "sent_at": result.sent_at,
+                    "completed_at": datetime.utcnow()
+                })
+                logger.info(f"Send-now request {send_request.id} sent job {job.id} to {job.recipient}")
+            else:
+                await self.fail_send_request(send_request, result.error_message)
+                
+        except Exception as e:
+            await self.fail_send_request(send_request, str(e))
+
+    async def fail_send_request(self, send_request: SendRequest, error: str):
+        """Mark a send-now request as failed."""
+        logger.error(f"Send-now request {send_request.id} for job {send_request.job_id} failed: {error}")
+        try:
+            await db.update_send_request(send_request.id, {
+                "status": SendRequestStatus.FAILED,
+                "error_message": error,
+                "completed_at": datetime.utcnow()
+            })
+        except Exception as e:
+            logger.error(f"Error recording failure of send-now request {send_request.id}: {e}")
+
+    async def record_failure(self, job: EmailJob, error: str, retryable: bool):
+        """Back off a failed job, or move it to the failed state once retries are exhausted."""
+        attempts = job.attempts + 1
+        if not retryable or attempts >= settings.send_max_attempts:
+            await db.record_job_failure(job.id, attempts, error, next_send=None, dead_letter=True)
+            logger.warning(
+                "Job %s marked as failed after %d attempt(s): %s", job.id, attempts, error, extra=hot_path(job_id=job.id)
+            )
+            return
+        
+        next_send = datetime.utcnow() + timedelta(seconds=compute_retry_delay(attempts))
+        await db.record_job_failure(job.id, attempts, error, next_send=next_send)
+        logger.info(
+            "Job %s will be retried at %s (attempt %d/%d)", job.id, next_send, attempts, settings.send_max_attempts,
+            extra=hot_path(job_id=job.id)
+        )
 
     async def schedule_job(self, job: EmailJob):
         """Schedule a new email job."""
         try:
             # Calculate next send time
-            now = datetime.utcnow()
-            if job.last_sent:
-                next_send = job.last_sent + timedelta(days=job.every_n_days)
-            else:
-                next_send = now + timedelta(days=job.every_n_days)
+            base = job.last_sent or datetime.utcnow()
+            next_send = await send_planner.plan(base, job.every_n_days, job.preferred_send_time)
             
             # Update job with next send time
             await db.update_email_job(
@@ -119,11 +264,8 @@ class EmailScheduler:
                 return
             
             # Calculate new next send time
-            now = datetime.utcnow()
-            if job.last_sent:
-                next_send = job.last_sent + timedelta(days=every_n_days)
-            else:
-                next_send = now + timedelta(days=every_n_days)
+            base = job.last_sent or datetime.utcnow()
+            next_send = await send_planner.plan(base, every_n_days, job.preferred_send_time)
             
             # Update job
             await db.update_email_job(
@@ -154,7 +296,7 @@ class EmailScheduler:
             logger.error(f"Error pausing job {job_id}: {e}")
 
     async def resume_job(self, job_id: str, user_id: str):
-        """Resume a paused email job."""
+        """Resume a paused or failed email job."""
         try:
             job = await db.get_email_job(job_id, user_id)
             if not job:
@@ -162,18 +304,17 @@ class EmailScheduler:
                 return
             
             # Calculate next send time
-            now = datetime.utcnow()
-            if job.last_sent:
-                next_send = job.last_sent + timedelta(days=job.every_n_days)
-            else:
-                next_send = now + timedelta(days=job.every_n_days)
+            base = job.last_sent or datetime.utcnow()
+            next_send = await send_planner.plan(base, job.every_n_days, job.preferred_send_time)
             
             await db.update_email_job(
                 job_id,
                 user_id,
                 {
                     "status": "active",
-                    "next_send": next_send
+                    "next_send": next_send,
+                    "attempts": 0,
+                    "last_error": None
                 }
             )
             
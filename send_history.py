@@ -0,0 +1,134 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+import uuid
+from config import settings
+from database import db, use_scheduler_pool
+from models import EmailJob, EmailSendResult
+
+logger = logging.getLogger(__name__)
+
+
+class SendHistoryRecorder:
+    """Buffer send outcomes in memory and write them to MongoDB in batches.
+
+    Recording is a list append on the send path; the round-trip to MongoDB is
+    paid once per batch, either when the batch fills up or on a timer. Each
+    batch also adds its per-user, per-day sent and failed counts to the
+    send_rollups that GET /stats reads, as one set of $inc upserts. Those
+    counts are written under a batch id and retried under the same id until
+    the write succeeds, so a write that failed after being partly applied is
+    never counted twice.
+    """
+
+    def __init__(self):
+        self.scheduler = AsyncIOScheduler()
+        self.is_running = False
+        self._buffer: List[dict] = []
+        # Counts not yet added to send_rollups, by (user_id, UTC day)
+        self._rollups: Dict[Tuple[str, str], Dict[str, int]] = {}
+        # Counts handed to a rollup write that has not succeeded yet, with their batch id
+        self._rollup_batch: Optional[Tuple[str, Dict[Tuple[str, str], Dict[str, int]]]] = None
+        self._flush_lock = asyncio.Lock()
+        # The event loop only keeps weak references to tasks
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    async def start(self):
+        """Start the periodic flush."""
+        if not self.is_running:
+            self.scheduler.start()
+            self.is_running = True
+            logger.info("Send history recorder started")
+
+            self.scheduler.add_job(
+                self.flush,
+                IntervalTrigger(seconds=settings.send_history_flush_seconds),
+                id='send_history_flush',
+                replace_existing=True
+            )
+
+    async def stop(self):
+        """Stop the periodic flush and write out whatever is still buffered."""
+        if self.is_running:
+            self.scheduler.shutdown()
+            self.is_running = False
+            if self._flush_task is not None:
+                await asyncio.gather(self._flush_task, return_exceptions=True)
+            await self.flush()
+            logger.info("Send history recorder stopped")
+
+    def record(self, email_job: EmailJob, result: EmailSendResult):
+        """Buffer the outcome of a send attempt."""
+        self._buffer.append({
+            "job_id": email_job.id,
+            "user_id": email_job.user_id,
+            "recipient": email_job.recipient,
+            "sent_at": result.sent_at,
+            "success": result.success,
+            "latency_ms": result.latency_ms,
+            "error_class": result.error_class,
+            "error_message": result.error_message
+        })
+        self._trim_buffer()
+        counts = self._rollups.setdefault(
+            (email_job.user_id, result.sent_at.date().isoformat()), {"sent": 0, "failed": 0}
+        )
+        counts["sent" if result.success else "failed"] += 1
+
+        if len(self._buffer) >= settings.send_history_batch_size and (
+            self._flush_task is None or self._flush_task.done()
+        ):
+            self._flush_task = asyncio.create_task(self.flush())
+            self._flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Send history flush failed: {task.exception()}")
+
+    async def flush(self):
+        """Write buffered entries and rollup counts to the database."""
+        use_scheduler_pool()
+        async with self._flush_lock:
+            if not (self._buffer or self._rollups or self._rollup_batch) or not db.is_connected:
+                return
+
+            batch, self._buffer = self._buffer, []
+            if batch:
+                try:
+                    await db.insert_send_history(batch)
+                except BulkWriteError as e:
+                    # Unordered insert: everything but the rejected documents was written
+                    logger.error(f"Send history batch partially written: {e.details.get('writeErrors', [])[:1]}")
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} send history entries: {e}")
+                    # Keep the entries for the next flush, oldest first
+                    self._buffer = batch + self._buffer
+                    self._trim_buffer()
+
+            # A batch that failed is retried as is, before any newer counts
+            if self._rollup_batch is None and self._rollups:
+                self._rollup_batch = (uuid.uuid4().hex, self._rollups)
+                self._rollups = {}
+            if self._rollup_batch is not None:
+                batch_id, rollups = self._rollup_batch
+                try:
+                    await db.increment_send_rollups(rollups, batch_id)
+                    self._rollup_batch = None
+                except Exception as e:
+                    logger.error(f"Failed to write {len(rollups)} send rollups, will retry batch {batch_id}: {e}")
+
+    def _trim_buffer(self):
+        """Drop the oldest entries once the buffer is full, e.g. while MongoDB is down."""
+        overflow = len(self._buffer) - settings.send_history_max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+            logger.warning(f"Send history buffer full, dropped {overflow} oldest entries")
+
+
+# Create send history recorder instance
+send_history = SendHistoryRecorder()
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import logging
+import random
+import time
+from config import settings
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# How long a loaded per-minute histogram is reused, so a bulk import of jobs
+# costs one load query rather than one per job
+LOAD_CACHE_SECONDS = 60
+
+
+def apply_preferred_time(send_at: datetime, preferred_send_time: Optional[str]) -> datetime:
+    """Move a send time to the job's preferred "HH:MM" (UTC) on the same day, if it has one."""
+    if not preferred_send_time:
+        return send_at
+    hour, minute = (int(part) for part in preferred_send_time.split(":"))
+    return send_at.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+
+class SendTimePlanner:
+    """Pick next_send times, spreading new schedules away from busy minutes.
+
+    Without smoothing, jobs created together (e.g. a campaign import) share a
+    next_send and fire in the same tick every N days, forever. With
+    SEND_SMOOTHING_ENABLED, a new schedule lands in the least loaded minute of
+    the SEND_SMOOTHING_WINDOW_MINUTES after its nominal time, and keeps that
+    offset on later sends. Jobs with a preferred send time are never moved.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._load: Dict[datetime, int] = {}
+        self._load_start: Optional[datetime] = None
+        self._loaded_at = 0.0
+
+    def next_send_after(self, sent_at: datetime, every_n_days: int, preferred_send_time: Optional[str] = None) -> datetime:
+        """next_send following a send: N days later, at the preferred time if any."""
+        return apply_preferred_time(sent_at + timedelta(days=every_n_days), preferred_send_time)
+
+    async def plan(self, base: datetime, every_n_days: int, preferred_send_time: Optional[str] = None) -> datetime:
+        """next_send for a new or changed schedule: N days after ``base``, smoothed."""
+        send_at = base + timedelta(days=every_n_days)
+        if preferred_send_time:
+            return apply_preferred_time(send_at, preferred_send_time)
+        if not settings.send_smoothing_enabled or not db.is_connected:
+            return send_at
+        try:
+            return await self.smooth(send_at)
+        except Exception as e:
+            logger.error(f"Failed to smooth send time {send_at}, keeping it: {e}")
+            return send_at
+
+    async def smooth(self, send_at: datetime) -> datetime:
+        """Move a send time into the least loaded minute of the window that follows it."""
+        start = send_at.replace(second=0, microsecond=0)
+        window = settings.send_smoothing_window_minutes
+        async with self._lock:
+            if self._load_start != start or time.monotonic() - self._loaded_at > LOAD_CACHE_SECONDS:
+                self._load = await db.get_send_load(start, start + timedelta(minutes=window))
+                self._load_start = start
+                self._loaded_at = time.monotonic()
+            # Least loaded minute, earliest on ties
+            offset = min(range(window), key=lambda offset: (self._load.get(start + timedelta(minutes=offset), 0), offset))
+            minute = start + timedelta(minutes=offset)
+            self._load[minute] = self._load.get(minute, 0) + 1
+        return max(send_at, minute + timedelta(seconds=random.uniform(0, 60)))
+
+
+# Create send time planner instance
+send_planner = SendTimePlanner()
@@ -0,0 +1,812 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from enum import Enum
+from bson import ObjectId
+import asyncio
+import json
+import logging
+import sqlite3
+from config import settings
+from database import Database
+from metrics import track_db_operation
+from models import (
+    User, EmailJob, EmailJobStatus, SendHistoryEntry, SendRequest, SendRequestStatus, IdempotencyRecord,
+    DailySendStats
+)
+from partitioning import partition_for_user
+from job_body import BODY_FIELDS, body_storage_fields
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    google_id TEXT NOT NULL UNIQUE,
+    access_token TEXT NOT NULL,
+    refresh_token TEXT,
+    token_expiry TEXT NOT NULL,
+    token_refresh_failed_at TEXT,
+    jobs_version INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_token_expiry ON users (token_expiry);
+
+CREATE TABLE IF NOT EXISTS email_jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attachments TEXT NOT NULL DEFAULT '[]',
+    every_n_days INTEGER NOT NULL,
+    preferred_send_time TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    last_sent TEXT,
+    next_send TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    scheduler_partition INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_jobs_status_next_send ON email_jobs (status, next_send);
+CREATE INDEX IF NOT EXISTS idx_email_jobs_user_id ON email_jobs (user_id);
+CREATE INDEX IF NOT EXISTS idx_email_jobs_user_status ON email_jobs (user_id, status);
+CREATE INDEX IF NOT EXISTS idx_email_jobs_deleted ON email_jobs (updated_at) WHERE status = 'deleted';
+
+CREATE TABLE IF NOT EXISTS email_jobs_archive (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attachments TEXT NOT NULL DEFAULT '[]',
+    every_n_days INTEGER NOT NULL,
+    preferred_send_time TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    last_sent TEXT,
+    next_send TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    scheduler_partition INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    archived_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS send_history (
+    id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    sent_at TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    latency_ms REAL,
+    error_class TEXT,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_send_history_job ON send_history (job_id, sent_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_send_history_sent_at ON send_history (sent_at);
+
+CREATE TABLE IF NOT EXISTS send_rollups (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS send_rollup_batches (
+    id TEXT PRIMARY KEY,
+    applied_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS send_requests (
+    id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    completed_at TEXT,
+    sent_at TEXT,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_send_requests_created_at ON send_requests (created_at);
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER,
+    response_body TEXT,
+    headers TEXT NOT NULL DEFAULT '{}',
+    created_at TEXT NOT NULL,
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys (created_at);
+
+CREATE TABLE IF NOT EXISTS scheduler_workers (
+    id TEXT PRIMARY KEY,
+    heartbeat_at TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release; CREATE TABLE IF NOT EXISTS leaves
+# existing tables alone, so they are added to older database files on connect
+ADDED_COLUMNS = [
+    ("users", "jobs_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("email_jobs", "scheduler_partition", "INTEGER"),
+    ("email_jobs", "preferred_send_time", "TEXT"),
+    ("email_jobs", "priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("email_jobs", "body_compressed", "BLOB"),
+    ("email_jobs_archive", "body_compressed", "BLOB"),
+]
+
+# Indexes over added columns, created once the columns exist
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_email_jobs_partition_due ON email_jobs (status, scheduler_partition, next_send);
+CREATE INDEX IF NOT EXISTS idx_email_jobs_priority_due ON email_jobs (status, priority DESC, next_send);
+"""
+
+BUMP_JOBS_VERSION = (
+    "UPDATE users SET jobs_version = jobs_version + 1 "
+    "WHERE id = (SELECT user_id FROM email_jobs WHERE id = ?)"
+)
+
+USER_COLUMNS = [
+    "id", "email", "name", "google_id", "access_token", "refresh_token",
+    "token_expiry", "jobs_version", "created_at", "updated_at"
+]
+JOB_COLUMNS = [
+    "id", "user_id", "recipient", "subject", "body", "body_compressed", "attachments", "every_n_days",
+    "preferred_send_time", "priority", "last_sent", "next_send", "status", "attempts", "last_error",
+    "scheduler_partition", "created_at", "updated_at"
+]
+HISTORY_COLUMNS = [
+    "id", "job_id", "user_id", "recipient", "sent_at", "success",
+    "latency_ms", "error_class", "error_message"
+]
+SEND_REQUEST_COLUMNS = [
+    "id", "job_id", "user_id", "status", "created_at", "started_at", "completed_at",
+    "sent_at", "error_message"
+]
+SEND_REQUEST_DATETIME_COLUMNS = ("created_at", "started_at", "completed_at", "sent_at")
+IDEMPOTENCY_COLUMNS = [
+    "key", "user_id", "fingerprint", "status_code", "response_body", "headers", "created_at",
+    "completed_at"
+]
+USER_DATETIME_COLUMNS = ("token_expiry", "created_at", "updated_at")
+JOB_DATETIME_COLUMNS = ("last_sent", "next_send", "created_at", "updated_at")
+
+
+def _encode(value):
+    """Convert a Python value to its SQLite column representation."""
+    if isinstance(value, datetime):
+        # Fixed-width text so that string order matches time order in indexes
+        return value.isoformat(sep=" ", timespec="microseconds")
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _decode_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _row_to_user(row: sqlite3.Row) -> User:
+    user_dict = dict(row)
+    for column in USER_DATETIME_COLUMNS:
+        user_dict[column] = _decode_datetime(user_dict[column])
+    return User(**user_dict)
+
+
+def _row_to_job(row: sqlite3.Row) -> EmailJob:
+    job_dict = dict(row)
+    job_dict["attachments"] = json.loads(job_dict["attachments"])
+    for column in JOB_DATETIME_COLUMNS:
+        job_dict[column] = _decode_datetime(job_dict[column])
+    return EmailJob.from_trusted(job_dict)
+
+
+def _row_to_history_entry(row: sqlite3.Row) -> SendHistoryEntry:
+    entry_dict = dict(row)
+    entry_dict["sent_at"] = _decode_datetime(entry_dict["sent_at"])
+    entry_dict["success"] = bool(entry_dict["success"])
+    return SendHistoryEntry(**entry_dict)
+
+
+def _row_to_send_request(row: sqlite3.Row) -> SendRequest:
+    request_dict = dict(row)
+    for column in SEND_REQUEST_DATETIME_COLUMNS:
+        request_dict[column] = _decode_datetime(request_dict[column])
+    request_dict["status"] = SendRequestStatus(request_dict["status"])
+    return SendRequest(**request_dict)
+
+
+def _row_to_idempotency_record(row: sqlite3.Row) -> IdempotencyRecord:
+    record_dict = dict(row)
+    record_dict["headers"] = json.loads(record_dict["headers"])
+    record_dict["created_at"] = _decode_datetime(record_dict["created_at"])
+    record_dict["completed_at"] = _decode_datetime(record_dict["completed_at"])
+    return IdempotencyRecord(**record_dict)
+
+
+class SQLiteDatabase(Database):
+    """Embedded SQLite backend for single-node installs, CI and benchmarks.
+
+    The connection lives on a single worker thread and every call is handed to
+    it through an executor, so the event loop never blocks on disk I/O and the
+    connection is never shared between threads. WAL mode lets readers in other
+    processes (e.g. the debug scripts) run alongside the writer.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._conn is not None
+
+    async def _run(self, func, *args):
+        """Run a function on the database thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        for table, column, definition in ADDED_COLUMNS:
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.executescript(ADDED_INDEXES)
+        # Jobs created before partitioning existed
+        conn.create_function("partition_for_user", 1, partition_for_user, deterministic=True)
+        conn.execute(
+            "UPDATE email_jobs SET scheduler_partition = partition_for_user(user_id) "
+            "WHERE scheduler_partition IS NULL"
+        )
+        conn.commit()
+        return conn
+
+    def _fetch(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql: str, params: tuple = ()) -> int:
+        cursor = self._conn.execute(sql, params)
+        self._conn.commit()
+        return cursor.rowcount
+
+    def _write_job(self, sql: str, params: tuple, job_id: str) -> int:
+        """Write to one job and bump its owner's jobs version in the same transaction."""
+        cursor = self._conn.execute(sql, params)
+        if cursor.rowcount > 0:
+            self._conn.execute(BUMP_JOBS_VERSION, (job_id,))
+        self._conn.commit()
+        return cursor.rowcount
+
+    def _insert_jobs(self, sql: str, rows: List[tuple], user_ids: List[str]):
+        self._conn.executemany(sql, rows)
+        self._conn.executemany(
+            "UPDATE users SET jobs_version = jobs_version + 1 WHERE id = ?",
+            [(user_id,) for user_id in set(user_ids)]
+        )
+        self._conn.commit()
+
+    async def connect(self):
+        """Open the database file and create the schema."""
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        try:
+            self._conn = await self._run(self._open)
+            logger.info(f"Connected to SQLite database at {self.path}")
+        except Exception as e:
+            logger.error(f"Failed to open SQLite database at {self.path}: {e}")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def close(self):
+        """Close the database connection."""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logger.info("Closed SQLite connection")
+
+    async def ping(self):
+        await self._run(self._fetch, "SELECT 1")
+
+    # User operations
+    @track_db_operation
+    async def create_user(self, user: User) -> User:
+        """Create a new user."""
+        user_dict = user.dict()
+        user_dict["id"] = str(ObjectId())
+        user_dict["created_at"] = datetime.utcnow()
+        user_dict["updated_at"] = datetime.utcnow()
+
+        await self._run(
+            self._write,
+            f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' * len(USER_COLUMNS))})",
+            tuple(_encode(user_dict[column]) for column in USER_COLUMNS)
+        )
+        return User(**user_dict)
+
+    async def _get_user(self, column: str, value: str) -> Optional[User]:
+        rows = await self._run(self._fetch, f"SELECT * FROM users WHERE {column} = ?", (value,))
+        return _row_to_user(rows[0]) if rows else None
+
+    @track_db_operation
+    async def get_user_by_google_id(self, google_id: str) -> Optional[User]:
+        """Get user by Google ID."""
+        return await self._get_user("google_id", google_id)
+
+    @track_db_operation
+    async def get_user_by_email(self, email: str) -> Optional[User]:
+        """Get user by email."""
+        return await self._get_user("email", email)
+
+    @track_db_operation
+    async def get_user_by_id(self, user_id: str) -> Optional[User]:
+        """Get user by id."""
+        return await self._get_user("id", user_id)
+
+    @track_db_operation
+    async def update_user_tokens(self, user_id: str, access_token: str, refresh_token: str, token_expiry: datetime):
+        """Update user's OAuth tokens."""
+        await self._run(
+            self._write,
+            "UPDATE users SET access_token = ?, refresh_token = COALESCE(?, refresh_token), "
+            "token_expiry = ?, token_refresh_failed_at = NULL, updated_at = ? WHERE id = ?",
+            (access_token, refresh_token or None, _encode(token_expiry), _encode(datetime.utcnow()), user_id)
+        )
+
+    @track_db_operation
+    async def get_users_with_expiring_tokens(self, expires_before: datetime, retry_before: datetime, limit: int) -> List[User]:
+        """Get users whose access token expires before the given time, soonest first."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT * FROM users WHERE token_expiry <= ? AND refresh_token IS NOT NULL "
+            "AND (token_refresh_failed_at IS NULL OR token_refresh_failed_at <= ?) "
+            "ORDER BY token_expiry LIMIT ?",
+            (_encode(expires_before), _encode(retry_before), limit)
+        )
+        return [_row_to_user(row) for row in rows]
+
+    @track_db_operation
+    async def mark_token_refresh_failed(self, user_id: str):
+        """Record a failed token refresh so the user is retried later."""
+        await self._run(
+            self._write,
+            "UPDATE users SET token_refresh_failed_at = ? WHERE id = ?",
+            (_encode(datetime.utcnow()), user_id)
+        )
+
+    # Email job operations
+    def _job_row(self, email_job: EmailJob, now: datetime) -> Tuple[dict, tuple]:
+        job_dict = email_job.dict()
+        job_dict.update(body_storage_fields(job_dict["body"]))
+        job_dict["id"] = str(ObjectId())
+        job_dict["scheduler_partition"] = partition_for_user(email_job.user_id)
+        job_dict["created_at"] = now
+        job_dict["updated_at"] = now
+        return job_dict, tuple(_encode(job_dict[column]) for column in JOB_COLUMNS)
+
+    async def _insert_email_jobs(self, email_jobs: List[EmailJob]) -> List[EmailJob]:
+        now = datetime.utcnow()
+        job_dicts, rows = zip(*(self._job_row(email_job, now) for email_job in email_jobs))
+        await self._run(
+            self._insert_jobs,
+            f"INSERT INTO email_jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+            list(rows),
+            [email_job.user_id for email_job in email_jobs]
+        )
+        return [EmailJob.from_trusted(job_dict) for job_dict in job_dicts]
+
+    @track_db_operation
+    async def create_email_job(self, email_job: EmailJob) -> EmailJob:
+        """Create a new email job."""
+        return (await self._insert_email_jobs([email_job]))[0]
+
+    @track_db_operation
+    async def create_email_jobs(self, email_jobs: List[EmailJob]) -> List[EmailJob]:
+        """Create several email jobs in one transaction."""
+        if not email_jobs:
+            return []
+        return await self._insert_email_jobs(email_jobs)
+
+    @track_db_operation
+    async def get_user_email_jobs(self, user_id: str, include_body: bool = True) -> List[EmailJob]:
+        """Get all email jobs for a user, optionally without reading the bodies."""
+        columns = "*" if include_body else ", ".join(column for column in JOB_COLUMNS if column not in BODY_FIELDS)
+        rows = await self._run(
+            self._fetch,
+            f"SELECT {columns} FROM email_jobs WHERE user_id = ? AND status != ?",
+            (user_id, EmailJobStatus.DELETED.value)
+        )
+        return [_row_to_job(row) for row in rows]
+
+    @track_db_operation
+    async def get_email_job(self, job_id: str, user_id: str) -> Optional[EmailJob]:
+        """Get a specific email job."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT * FROM email_jobs WHERE id = ? AND user_id = ?",
+            (job_id, user_id)
+        )
+        return _row_to_job(rows[0]) if rows else None
+
+    @track_db_operation
+    async def update_email_job(self, job_id: str, user_id: str, update_data: dict) -> Optional[EmailJob]:
+        """Update an email job."""
+        if "body" in update_data:
+            update_data.update(body_storage_fields(update_data["body"]))
+        update_data["updated_at"] = datetime.utcnow()
+        unknown = set(update_data) - set(JOB_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown email job fields: {', '.join(sorted(unknown))}")
+
+        assignments = ", ".join(f"{column} = ?" for column in update_data)
+        updated = await self._run(
+            self._write_job,
+            f"UPDATE email_jobs SET {assignments} WHERE id = ? AND user_id = ?",
+            tuple(_encode(value) for value in update_data.values()) + (job_id, user_id),
+            job_id
+        )
+        if updated > 0:
+            return await self.get_email_job(job_id, user_id)
+        return None
+
+    @track_db_operation
+    async def delete_email_job(self, job_id: str, user_id: str) -> bool:
+        """Soft delete an email job."""
+        updated = await self._run(
+            self._write_job,
+            "UPDATE email_jobs SET status = ?, updated_at = ? WHERE id = ? AND user_id = ? AND status != ?",
+            (EmailJobStatus.DELETED.value, _encode(datetime.utcnow()), job_id, user_id, EmailJobStatus.DELETED.value),
+            job_id
+        )
+        return updated > 0
+
+    def _due_filter(self, partitions: Optional[List[int]]) -> Tuple[str, tuple]:
+        sql = "status = ? AND (next_send IS NULL OR next_send <= ?)"
+        params = (EmailJobStatus.ACTIVE.value, _encode(datetime.utcnow()))
+        if partitions is not None:
+            sql += f" AND scheduler_partition IN ({', '.join('?' * len(partitions))})"
+            params += tuple(partitions)
+        return sql, params
+
+    @track_db_operation
+    async def get_due_email_jobs(self, partitions: Optional[List[int]] = None, limit: Optional[int] = None) -> List[EmailJob]:
+        """Get email jobs that are due to be sent, highest priority then most overdue first."""
+        where, params = self._due_filter(partitions)
+        # NULL next_send (never scheduled) sorts first
+        sql = f"SELECT * FROM email_jobs WHERE {where} ORDER BY priority DESC, next_send ASC"
+        if limit:
+            sql += " LIMIT ?"
+            params += (limit,)
+        rows = await self._run(self._fetch, sql, params)
+        return [_row_to_job(row) for row in rows]
+
+    @track_db_operation
+    async def count_due_email_jobs(self, partitions: Optional[List[int]] = None) -> int:
+        """Count the email jobs that are due to be sent."""
+        where, params = self._due_filter(partitions)
+        rows = await self._run(self._fetch, f"SELECT COUNT(*) AS count FROM email_jobs WHERE {where}", params)
+        return rows[0]["count"]
+
+    @track_db_operation
+    async def get_send_load(self, start: datetime, end: datetime) -> Dict[datetime, int]:
+        """Count active jobs per minute of next_send in ``[start, end)``."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT substr(next_send, 1, 16) AS minute, COUNT(*) AS count FROM email_jobs "
+            "WHERE status = ? AND next_send >= ? AND next_send < ? GROUP BY minute",
+            (EmailJobStatus.ACTIVE.value, _encode(start), _encode(end))
+        )
+        return {datetime.fromisoformat(row["minute"]): row["count"] for row in rows}
+
+    @track_db_operation
+    async def update_job_sent_time(self, job_id: str, sent_time: datetime, next_send: datetime):
+        """Update an active job's last sent time and next send time."""
+        await self._run(
+            self._write_job,
+            "UPDATE email_jobs SET last_sent = ?, next_send = ?, attempts = 0, last_error = NULL, "
+            "updated_at = ? WHERE id = ? AND status = 'active'",
+            (_encode(sent_time), _encode(next_send), _encode(datetime.utcnow()), job_id),
+            job_id
+        )
+
+    @track_db_operation
+    async def record_job_failure(self, job_id: str, attempts: int, error: str, next_send: Optional[datetime], dead_letter: bool = False):
+        """Record a failed send attempt on an active job, either rescheduling or dead-lettering it."""
+        update = {
+            "attempts": attempts,
+            "last_error": error,
+            "next_send": next_send,
+            "updated_at": datetime.utcnow()
+        }
+        if dead_letter:
+            update["status"] = EmailJobStatus.FAILED
+        assignments = ", ".join(f"{column} = ?" for column in update)
+        await self._run(
+            self._write_job,
+            f"UPDATE email_jobs SET {assignments} WHERE id = ? AND status = 'active'",
+            tuple(_encode(value) for value in update.values()) + (job_id,),
+            job_id
+        )
+
+    # Job archive operations
+    def _archive_jobs(self, deleted_before: str, limit: int, partitions: Optional[List[int]]) -> int:
+        # The status literal lets SQLite use the partial index over deleted jobs
+        sql = "SELECT id FROM email_jobs INDEXED BY idx_email_jobs_deleted WHERE status = 'deleted' AND updated_at < ?"
+        params = (deleted_before,)
+        if partitions is not None:
+            sql += f" AND scheduler_partition IN ({', '.join('?' * len(partitions))})"
+            params += tuple(partitions)
+        ids = tuple(row["id"] for row in self._conn.execute(f"{sql} LIMIT ?", params + (limit,)))
+        if not ids:
+            return 0
+        in_ids = ", ".join("?" * len(ids))
+        columns = ", ".join(JOB_COLUMNS)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO email_jobs_archive ({columns}, archived_at) "
+            f"SELECT {columns}, ? FROM email_jobs WHERE id IN ({in_ids})",
+            (_encode(datetime.utcnow()),) + ids
+        )
+        cursor = self._conn.execute(f"DELETE FROM email_jobs WHERE id IN ({in_ids})", ids)
+        self._conn.commit()
+        return cursor.rowcount
+
+    @track_db_operation
+    async def archive_deleted_jobs(self, deleted_before: datetime, limit: int, partitions: Optional[List[int]] = None) -> int:
+        """Move up to ``limit`` jobs deleted before ``deleted_before`` to email_jobs_archive."""
+        return await self._run(self._archive_jobs, _encode(deleted_before), limit, partitions)
+
+    def _job_storage_stats(self) -> Dict[str, int]:
+        try:
+            rows = self._conn.execute(
+                "SELECT name, SUM(pgsize) AS bytes FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = 'email_jobs') GROUP BY name"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # SQLite built without the dbstat table
+            return {}
+        jobs = self._conn.execute("SELECT COUNT(*) FROM email_jobs").fetchone()[0]
+        return {
+            "collection_bytes": sum(row["bytes"] for row in rows if row["name"] == "email_jobs"),
+            "index_bytes": sum(row["bytes"] for row in rows if row["name"] != "email_jobs"),
+            "jobs": jobs
+        }
+
+    @track_db_operation
+    async def get_job_storage_stats(self) -> Dict[str, int]:
+        """Bytes used by the email_jobs table and indexes (from dbstat), and the job count."""
+        return await self._run(self._job_storage_stats)
+
+    # Send history operations
+    def _insert_history(self, rows: List[tuple], expired_before: str):
+        self._conn.executemany(
+            f"INSERT INTO send_history ({', '.join(HISTORY_COLUMNS)}) VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})",
+            rows
+        )
+        # Stand-in for MongoDB's TTL index; cheap thanks to the sent_at index
+        self._conn.execute("DELETE FROM send_history WHERE sent_at < ?", (expired_before,))
+        self._conn.commit()
+
+    @track_db_operation
+    async def insert_send_history(self, entries: List[dict]):
+        """Insert a batch of send history entries and expire old ones."""
+        rows = [
+            tuple(_encode(str(ObjectId()) if column == "id" else entry.get(column)) for column in HISTORY_COLUMNS)
+            for entry in entries
+        ]
+        expired_before = datetime.utcnow() - timedelta(days=settings.send_history_ttl_days)
+        await self._run(self._insert_history, rows, _encode(expired_before))
+
+    @track_db_operation
+    async def get_job_send_history(
+        self,
+        job_id: str,
+        user_id: str,
+        limit: int,
+        before: Optional[Tuple[datetime, str]] = None
+    ) -> List[SendHistoryEntry]:
+        """Get a job's send history, newest first, keyset-paginated on ``(sent_at, id)``."""
+        sql = "SELECT * FROM send_history WHERE job_id = ? AND user_id = ?"
+        params = (job_id, user_id)
+        if before:
+            before_sent_at, before_id = before
+            sql += " AND (sent_at < ? OR (sent_at = ? AND id < ?))"
+            params += (_encode(before_sent_at), _encode(before_sent_at), before_id)
+        sql += " ORDER BY sent_at DESC, id DESC LIMIT ?"
+        rows = await self._run(self._fetch, sql, params + (limit,))
+        return [_row_to_history_entry(row) for row in rows]
+
+    # Send rollup operations
+    def _increment_rollups(self, rows: List[tuple], batch_id: str, applied_at: str, expired_before: str):
+        # Applied in one transaction with the batch id, so a retried batch is a no-op
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO send_rollup_batches (id, applied_at) VALUES (?, ?)",
+            (batch_id, applied_at)
+        )
+        if cursor.rowcount == 0:
+            self._conn.rollback()
+            return
+        self._conn.execute("DELETE FROM send_rollup_batches WHERE applied_at < ?", (expired_before,))
+        self._conn.executemany(
+            "INSERT INTO send_rollups (user_id, day, sent, failed, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, day) DO UPDATE SET sent = sent + excluded.sent, "
+            "failed = failed + excluded.failed, updated_at = excluded.updated_at",
+            rows
+        )
+        self._conn.commit()
+
+    @track_db_operation
+    async def increment_send_rollups(self, counts: Dict[Tuple[str, str], Dict[str, int]], batch_id: str):
+        """Add counts to each ``(user_id, day)`` rollup in one upsert batch, once per ``batch_id``."""
+        now = datetime.utcnow()
+        updated_at = _encode(now)
+        rows = [
+            (user_id, day, day_counts.get("sent", 0), day_counts.get("failed", 0), updated_at)
+            for (user_id, day), day_counts in counts.items()
+        ]
+        # Batch ids are only needed until a failed flush has been retried
+        await self._run(self._increment_rollups, rows, batch_id, updated_at, _encode(now - timedelta(days=1)))
+
+    @track_db_operation
+    async def get_send_rollups(self, user_id: str, start_day: date, end_day: date) -> List[DailySendStats]:
+        """Get a user's daily rollups from ``start_day`` to ``end_day`` inclusive."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT day, sent, failed FROM send_rollups WHERE user_id = ? AND day >= ? AND day <= ? ORDER BY day",
+            (user_id, start_day.isoformat(), end_day.isoformat())
+        )
+        return [DailySendStats(date=row["day"], sent=row["sent"], failed=row["failed"]) for row in rows]
+
+    @track_db_operation
+    async def count_pending_jobs(self, user_id: str) -> int:
+        """Count a user's active jobs."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT COUNT(*) AS count FROM email_jobs WHERE user_id = ? AND status = ?",
+            (user_id, EmailJobStatus.ACTIVE.value)
+        )
+        return rows[0]["count"]
+
+    # Send request operations
+    def _insert_send_request(self, row: tuple, expired_before: str):
+        self._conn.execute(
+            f"INSERT INTO send_requests ({', '.join(SEND_REQUEST_COLUMNS)}) VALUES ({', '.join('?' * len(SEND_REQUEST_COLUMNS))})",
+            row
+        )
+        # Stand-in for MongoDB's TTL index
+        self._conn.execute("DELETE FROM send_requests WHERE created_at < ?", (expired_before,))
+        self._conn.commit()
+
+    @track_db_operation
+    async def create_send_request(self, send_request: SendRequest) -> SendRequest:
+        """Store a new send-now request and expire old ones."""
+        request_dict = send_request.dict()
+        request_dict["id"] = str(ObjectId())
+        expired_before = datetime.utcnow() - timedelta(hours=settings.send_request_ttl_hours)
+        await self._run(
+            self._insert_send_request,
+            tuple(_encode(request_dict[column]) for column in SEND_REQUEST_COLUMNS),
+            _encode(expired_before)
+        )
+        return SendRequest(**request_dict)
+
+    @track_db_operation
+    async def update_send_request(self, send_id: str, update_data: dict):
+        """Update a send-now request."""
+        unknown = set(update_data) - set(SEND_REQUEST_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown send request fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{column} = ?" for column in update_data)
+        await self._run(
+            self._write,
+            f"UPDATE send_requests SET {assignments} WHERE id = ?",
+            tuple(_encode(value) for value in update_data.values()) + (send_id,)
+        )
+
+    @track_db_operation
+    async def get_send_request(self, send_id: str, user_id: str) -> Optional[SendRequest]:
+        """Get a user's send-now request."""
+        rows = await self._run(
+            self._fetch,
+            "SELECT * FROM send_requests WHERE id = ? AND user_id = ?",
+            (send_id, user_id)
+        )
+        return _row_to_send_request(rows[0]) if rows else None
+
+    # Idempotency key operations
+    def _claim_idempotency_key(self, row: tuple, key: str, expired_before: str) -> Optional[sqlite3.Row]:
+        # Stand-in for MongoDB's TTL index
+        self._conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (expired_before,))
+        cursor = self._conn.execute(
+            f"INSERT OR IGNORE INTO idempotency_keys ({', '.join(IDEMPOTENCY_COLUMNS)}) VALUES ({', '.join('?' * len(IDEMPOTENCY_COLUMNS))})",
+            row
+        )
+        self._conn.commit()
+        if cursor.rowcount:
+            return None
+        return self._conn.execute("SELECT * FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+
+    @track_db_operation
+    async def claim_idempotency_key(self, record: IdempotencyRecord) -> Optional[IdempotencyRecord]:
+        """Claim a key; returns None if claimed, else the unexpired record that already holds it."""
+        record_dict = record.dict()
+        expired_before = datetime.utcnow() - timedelta(hours=settings.idempotency_key_ttl_hours)
+        existing = await self._run(
+            self._claim_idempotency_key,
+            tuple(_encode(record_dict[column]) for column in IDEMPOTENCY_COLUMNS),
+            record.key,
+            _encode(expired_before)
+        )
+        return _row_to_idempotency_record(existing) if existing else None
+
+    @track_db_operation
+    async def get_idempotency_key(self, key: str) -> Optional[IdempotencyRecord]:
+        """Get the record holding a key."""
+        rows = await self._run(self._fetch, "SELECT * FROM idempotency_keys WHERE key = ?", (key,))
+        return _row_to_idempotency_record(rows[0]) if rows else None
+
+    @track_db_operation
+    async def complete_idempotency_key(self, key: str, status_code: int, response_body: str, headers: Dict[str, str]):
+        """Store the response of the request that claimed a key."""
+        await self._run(
+            self._write,
+            "UPDATE idempotency_keys SET status_code = ?, response_body = ?, headers = ?, completed_at = ? WHERE key = ?",
+            (status_code, response_body, _encode(headers), _encode(datetime.utcnow()), key)
+        )
+
+    @track_db_operation
+    async def release_idempotency_key(self, key: str):
+        """Give up an unfinished claim so the key can be retried."""
+        await self._run(
+            self._write,
+            "DELETE FROM idempotency_keys WHERE key = ? AND completed_at IS NULL",
+            (key,)
+        )
+
+    # Scheduler worker operations
+    @track_db_operation
+    async def heartbeat_worker(self, worker_id: str, now: datetime):
+        """Record that a scheduler worker is alive."""
+        await self._run(
+            self._write,
+            "INSERT INTO scheduler_workers (id, heartbeat_at) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+            (worker_id, _encode(now))
+        )
+
+    @track_db_operation
+    async def get_live_workers(self, since: datetime) -> List[str]:
+        """Get the ids of scheduler workers that heartbeated after ``since``."""
+        rows = await self._run(self._fetch, "SELECT id FROM scheduler_workers WHERE heartbeat_at > ?", (_encode(since),))
+        return [row["id"] for row in rows]
+
+    @track_db_operation
+    async def remove_worker(self, worker_id: str):
+        """Forget a scheduler worker that is shutting down."""
+        await self._run(self._write, "DELETE FROM scheduler_workers WHERE id = ?", (worker_id,))
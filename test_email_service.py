@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Tests for classifying Gmail send errors as retryable or permanent
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+import pytest
+
+from email_service import classify_send_error
+
+
+def gmail_403(reason: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://gmail.googleapis.com/gmail/v1/users/me/messages/send")
+    response = httpx.Response(
+        403,
+        json={"error": {"code": 403, "message": "Forbidden", "errors": [{"domain": "usageLimits", "reason": reason}]}},
+        request=request
+    )
+    return httpx.HTTPStatusError("Forbidden", request=request, response=response)
+
+
+@pytest.mark.parametrize("reason", ["rateLimitExceeded", "userRateLimitExceeded", "dailyLimitExceeded", "quotaExceeded"])
+def test_rate_limit_and_quota_403s_are_retryable(reason):
+    assert classify_send_error(gmail_403(reason)) == ("gmail_rate_limited", True)
+
+
+def test_other_403s_are_permanent():
+    assert classify_send_error(gmail_403("insufficientPermissions")) == ("gmail_403", False)
+
+
+def test_403_without_json_body_is_permanent():
+    request = httpx.Request("POST", "https://gmail.googleapis.com/gmail/v1/users/me/messages/send")
+    response = httpx.Response(403, text="Forbidden", request=request)
+    error = httpx.HTTPStatusError("Forbidden", request=request, response=response)
+    assert classify_send_error(error) == ("gmail_403", False)
@@ -31,12 +31,12 @@ def test_dependencies():
         'apscheduler',
         'google.auth',
         'google_auth_oauthlib',
-        'googleapiclient',
         'jose',
         'pydantic',
         'pydantic_settings',
         'httpx',
-        'aiofiles'
+        'aiofiles',
+        'prometheus_client'
     ]
     
     missing_packages = []
@@ -0,0 +1,121 @@
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
+from config import settings
+from database import db, use_scheduler_pool
+from models import User
+from auth import google_oauth2
+
+logger = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """Refresh OAuth access tokens in the background before they expire.
+
+    Keeping stored tokens ahead of their expiry means the send path never has
+    to pay for a token round-trip to Google.
+    """
+
+    def __init__(self):
+        self.scheduler = AsyncIOScheduler()
+        self.is_running = False
+        self.last_run: Optional[datetime] = None
+        self.last_refreshed = 0
+        self.last_failed = 0
+
+    async def start(self):
+        """Start the background refresher."""
+        if not self.is_running:
+            self.scheduler.start()
+            self.is_running = True
+            logger.info("Token refresher started")
+
+            self.scheduler.add_job(
+                self.refresh_expiring_tokens,
+                IntervalTrigger(seconds=settings.token_refresh_interval_seconds),
+                id='token_refresher',
+                replace_existing=True,
+                next_run_time=datetime.now()
+            )
+
+    async def stop(self):
+        """Stop the background refresher."""
+        if self.is_running:
+            self.scheduler.shutdown()
+            self.is_running = False
+            logger.info("Token refresher stopped")
+
+    async def refresh_expiring_tokens(self):
+        """Refresh every token that expires within the lead window, batch by batch."""
+        use_scheduler_pool()
+        if not db.is_connected:
+            return
+
+        refreshed = 0
+        failed = 0
+        semaphore = asyncio.Semaphore(settings.token_refresh_concurrency)
+
+        async def refresh_one(user: User) -> bool:
+            async with semaphore:
+                return await self.refresh_user_token(user)
+
+        seen = set()
+
+        try:
+            # Each batch is taken fresh from the index; refreshed users move out of
+            # the window and failed users are excluded until their retry time.
+            while True:
+                now = datetime.utcnow()
+                users = await db.get_users_with_expiring_tokens(
+                    expires_before=now + timedelta(minutes=settings.token_refresh_lead_minutes),
+                    retry_before=now - timedelta(minutes=settings.token_refresh_retry_minutes),
+                    limit=settings.token_refresh_batch_size
+                )
+                users = [user for user in users if user.id not in seen]
+                if not users:
+                    break
+                seen.update(user.id for user in users)
+
+                results = await asyncio.gather(*(refresh_one(user) for user in users))
+                batch_refreshed = sum(1 for ok in results if ok)
+                refreshed += batch_refreshed
+                failed += len(results) - batch_refreshed
+
+                if len(users) < settings.token_refresh_batch_size:
+                    break
+
+            if refreshed or failed:
+                logger.info(f"Token refresh pass: {refreshed} refreshed, {failed} failed")
+        except Exception as e:
+            logger.error(f"Error in refresh_expiring_tokens: {e}")
+        finally:
+            self.last_run = datetime.utcnow()
+            self.last_refreshed = refreshed
+            self.last_failed = failed
+
+    async def refresh_user_token(self, user: User) -> bool:
+        """Refresh a single user's token and store it. Returns True on success."""
+        try:
+            tokens = await google_oauth2.refresh_access_token(user.refresh_token)
+            expiry = tokens.get("expiry") or datetime.utcnow() + timedelta(hours=1)
+            await db.update_user_tokens(
+                user.id,
+                tokens["access_token"],
+                tokens["refresh_token"],
+                expiry
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to refresh token for user {user.id}: {e}")
+            try:
+                await db.mark_token_refresh_failed(user.id)
+            except Exception as mark_error:
+                logger.error(f"Failed to record token refresh failure for user {user.id}: {mark_error}")
+            return False
+
+
+# Create token refresher instance
+token_refresher = TokenRefresher()